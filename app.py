@@ -1,7 +1,10 @@
 from libs.camera import VideoCamera
 import cv2
+from libs.frame_buffer import FrameBuffer
 from libs.interactive_detection import Detections
+from libs.renderer import Renderer
 from libs.argparser import build_argparser
+from libs.log_utils import setup_logging
 from openvino.inference_engine import get_version
 import configparser
 from PyQt5.QtCore import QObject, pyqtSlot, Qt, QThread, pyqtSignal
@@ -12,8 +15,9 @@ from PyQt5 import QtWidgets, QtCore, QtGui, QtWidgets
 import sys
 from typing import List
 from collections import deque
-from logging import getLogger, basicConfig, DEBUG, INFO
-import random
+from logging import getLogger, DEBUG, INFO
+from time import sleep
+from timeit import default_timer as timer
 
 logger = getLogger(__name__)
 
@@ -21,45 +25,77 @@ logger = getLogger(__name__)
 config = configparser.ConfigParser()
 config.read("config.ini")
 resize_width = int(config.get("CAMERA", "resize_width"))
+frame_buffer_size = int(config.get("CAMERA", "frame_buffer_size"))
 prob_thld_person = eval(config.get("DETECTION", "prob_thld_person"))
 
 # 全域變數
 frame_id: int = 0
-detections_list = []
+# (frame 序號, detections_list, 辨識結果) 以單一 tuple 一次指派,
+# 讀取端不會拿到不同 frame 的序號與結果
+det_state = (0, [], None)
 is_det: bool = True
 is_reid: bool = True
 show_track: bool = True
 flip_code: int = 1
 
-det_time_det = 0
-det_time_reid = 0
-det_fps = "FPS: ??"
-
 size_scale: float = 1.0
 
-# 辨識執行緒
-class detThread(QThread):
+# 擷取執行緒
+# 唯一讀取 camera 的執行緒, 解碼後的 frame 放入 frame_buffer 給其他執行緒共用
+class captureThread(QThread):
     def __init__(self, parent: QObject) -> None:
         super().__init__(parent)
         self.camera = camera    # camera from main
         self.stopped = False
+        # video files are read at their fps (a camera waits for frames by itself)
+        fps = camera.cap.get(cv2.CAP_PROP_FPS) if camera.input_stream != 0 else 0
+        self.interval = 1 / fps if fps > 0 else 0
 
     def run(self) -> None:
-        global detections_list  # 修改全域變數 detections_list
-        global det_time_det
-        global det_time_reid
-        global det_fps
-
+        next_time = timer()
         while self.stopped is not True:
             frame = self.camera.get_frame(flip_code)
             if frame is None:
                 break
+            frame_buffer.put(frame)
+
+            if self.interval:
+                next_time += self.interval
+                delay = next_time - timer()
+                if delay > 0:
+                    sleep(delay)
+        frame_buffer.close()
 
-            frame, detections_list = detections.person_detection(   # is_async = True
-                frame, True, is_det, is_reid, str(frame_id), show_track
+    def quit(self) -> None:
+        self.stopped = True
+        return super().quit()
+
+# 辨識執行緒
+class detThread(QThread):
+    def __init__(self, parent: QObject) -> None:
+        super().__init__(parent)
+        self.stopped = False
+
+    def run(self) -> None:
+        global det_state  # 修改全域變數 det_state
+
+        seq = 0
+        while self.stopped is not True:
+            # 等待下一個 frame (處理較慢時跳到最新的 frame)
+            item = frame_buffer.wait(seq, timeout=0.5)
+            if item is None:
+                if frame_buffer.closed:
+                    break
+                continue
+            seq, _, frame = item
+
+            # 只取得結果, 畫面由 VideoThread 繪製
+            # frame 序號作為 frame_id, 結果屬於 pipeline 中較早的 frame
+            result, detections_list = detections.person_detection(   # is_async = True
+                frame, True, is_det, is_reid, str(seq)
             )
-            det_time_det, det_time_reid = detections.get_det_time()
-            det_fps = detections.get_fps()
+            if result is not None:
+                det_state = (int(result["frame_id"]), detections_list, result)
 
     def quit(self) -> None:
         self.stopped = True
@@ -71,135 +107,33 @@ class VideoThread(QThread):
 
     def __init__(self, parent: QObject):
         super().__init__(parent)
-        self.camera = camera
         self.stopped = False
-
-    def draw_stats(self, frame):
-        # time
-        det_time = det_time_det + det_time_reid
-        inf_time_message = (
-            f"Total Inference time: {det_time * 1000:.3f} ms for async mode"
-        )
-        cv2.putText(
-            frame,
-            inf_time_message,
-            (10, 15),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            (10, 10, 200),
-            1,
-        )
-        det_time_txt = None
-        if is_det or is_reid:
-            det_time_txt = f"det:{det_time_det * 1000:.3f} ms "
-        if is_reid:
-            det_time_txt = det_time_txt + \
-                f"reid:{det_time_reid * 1000:.3f} ms"
-        if det_time_txt is not None:
-            inf_time_message = (
-                f"@Detection prob:{prob_thld_person} time: {det_time_txt}"
-            )
-            cv2.putText(
-                frame,
-                inf_time_message,
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.4,
-                (10, 10, 200),
-                1,
-            )
-        # det FPS, det person count
-        cv2.rectangle(
-            frame, 
-            (frame.shape[1] - 75, 0), 
-            (frame.shape[1], 34), 
-            (255, 255, 255), 
-            -1
-        )
-        cv2.putText(
-            frame,
-            f"DET {det_fps}",
-            (frame.shape[1] - 75 + 3, 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.35,
-            (0, 0, 0),
-            1,
-        )
-        person_counter = len(detections_list)
-        cv2.putText(
-            frame,
-            f"DET: {person_counter}",
-            (frame.shape[1] - 75 + 3, 27),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.35,
-            (0, 0, 0),
-            1,
-        )
-        return frame
-
-    def draw_box(self, frame):
-        for detection in detections_list:
-            result = f"{detection['id']} {detection['confidence']}%"
-            size = cv2.getTextSize(result, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
-            xmin, ymin, xmax, ymax = detection['bbox']
-            random.seed(detection['id'])
-            color = (
-                random.randint(100, 255),
-                random.randint(100, 255), 
-                random.randint(100, 255)
-                )
-            xtext = xmin + size[0][0] + 20
-            cv2.rectangle(
-                frame, (xmin, ymin - 22), (xtext, ymin), color, -1,
-            )
-            cv2.rectangle(
-                frame, (xmin, ymin - 22), (xtext, ymin), color,
-            )
-            cv2.rectangle(
-                frame, (xmin, ymin), (xmax, ymax), color, 1,
-            )
-            cv2.putText(
-                frame,
-                result,
-                (xmin + 3, ymin - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.4,
-                (0, 0, 0),
-                1,
-            )
-        return frame
-    
-    def draw_track_points(self, frame):
-        for detection in detections_list:
-            if detection.get('track_points') is None:
-                break
-            tp = np.array(detection['track_points'])
-            track_points = tp[~np.isnan(tp).any(axis=1)].astype(int)
-            if len(track_points) > 2:
-                track_points = np.array(track_points)
-                green = (0, 255, 0)
-                cv2.polylines(
-                    frame, [track_points], isClosed=False, color=green, thickness=2,
-                )
-        return frame
+        self.renderer = Renderer()
 
     def run(self):
         global frame_id
 
         frame_id = 0
         while self.stopped is not True:
-            frame_id += 1
-            frame = self.camera.get_frame(flip_code)
-            if frame is None:
-                break
-
-            # 畫狀態
-            self.draw_stats(frame)
-            # 畫框框
-            self.draw_box(frame)
-            # 畫軌跡
-            if is_reid and show_track:
-                self.draw_track_points(frame)
+            item = frame_buffer.wait(frame_id, timeout=0.5)
+            if item is None:
+                if frame_buffer.closed:
+                    break
+                continue
+            frame_id, _, frame = item
+            det_seq, _, result = det_state
+            if result is None:
+                # 尚未有辨識結果, 共用的 frame 為唯讀, 複製後再送出
+                self.frame_signal.emit(frame.copy())
+                continue
+            # 畫在辨識結果所屬的 frame 上, 已被移出 frame_buffer 時才用最新的 frame
+            det_item = frame_buffer.get(det_seq)
+            if det_item is not None:
+                frame = det_item[2]
+
+            # 畫框框, 軌跡, 計數線, 遮蔽的人與狀態 (唯讀的 frame 會先複製)
+            self.renderer.show_track = show_track
+            frame = self.renderer.render(dict(result, frame=frame))
 
             self.frame_signal.emit(frame)
 
@@ -214,7 +148,6 @@ class ZoomVideoThread(QThread):
 
     def __init__(self, parent: QDialog) -> None:
         super().__init__(parent)
-        self.camera = camera
         self.stopped = False
 
         self.avg_num = 20
@@ -256,10 +189,19 @@ class ZoomVideoThread(QThread):
         return frame
 
     def run(self) -> None:
+        seq = 0
         while self.stopped is not True:
-            frame = self.camera.get_frame(flip_code)
-            if frame is None:
-                break
+            item = frame_buffer.wait(seq, timeout=0.5)
+            if item is None:
+                if frame_buffer.closed:
+                    break
+                continue
+            seq, _, frame = item
+            det_seq, detections_list, _ = det_state
+            # 使用 detections_list 所屬的 frame 裁切, 避免框偏離人物
+            det_item = frame_buffer.get(det_seq)
+            if det_item is not None:
+                frame = det_item[2]
             # code here
             for detection in detections_list:
                 if detection['id'] is not self.id:
@@ -416,6 +358,9 @@ class MainWindow(QMainWindow):
 
         self.setWindowTitle("ReID")  # 視窗標題
 
+        self.capture_thread = captureThread(self)
+        self.capture_thread.start()
+
         self.video_thread = VideoThread(self)
         self.video_thread.frame_signal.connect(self.update_video)
         self.video_thread.start()
@@ -494,6 +439,7 @@ class MainWindow(QMainWindow):
         self.video_label.setPixmap(pixmap)
 
         # update buttons
+        _, detections_list, _ = det_state
         for detection in detections_list:
             button_exist: bool = False
             for button in self.buttons:
@@ -521,6 +467,8 @@ class MainWindow(QMainWindow):
         '''
 
     def closeEvent(self, event):
+        self.capture_thread.quit()
+        self.capture_thread.wait()
         self.det_thread.quit()
         self.det_thread.wait()
         self.video_thread.quit()
@@ -552,9 +500,8 @@ class MainWindow(QMainWindow):
 
 if __name__ == "__main__":
     level = INFO
-    basicConfig(
-        filename="app.log",
-        filemode="w",
+    setup_logging(
+        "app.log",
         level=level,
         format="%(asctime)s %(levelname)s %(name)s %(funcName)s:%(lineno)d %(message)s",
     )
@@ -563,6 +510,7 @@ if __name__ == "__main__":
     args = build_argparser().parse_args()
     devices = [args.device, args.device_reidentification]
     camera = VideoCamera(args.input, resize_width, args.v4l)
+    frame_buffer = FrameBuffer(frame_buffer_size)
     detections = Detections(camera.frame, devices, args.grid)
     app = QApplication([])
     window = MainWindow()
@@ -0,0 +1,246 @@
+"""Per-stage micro-benchmark
+
+Measure each stage of person detection, re-identification and tracking on
+its own at several crowd sizes, and write latency percentiles to a json file
+which can be compared between versions.
+
+ex. python benchmark.py -o bench.json
+    python benchmark.py --no_models --sizes 10 40 80
+"""
+import configparser
+import json
+import platform
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+
+import numpy as np
+
+from libs.assignment import ASSIGNMENT_SOLVERS
+from libs.tracker import Tracker
+from libs.utils import cos_similarity, get_iou_matrix, get_person_frames, l2_normalize
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+resize_width = int(config.get("CAMERA", "resize_width"))
+
+FRAME_SHAPE = (576, resize_width, 3)
+FEATURE_DIM = 256
+BOX_W, BOX_H = 40, 90
+
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        help="Crowd sizes (the number of persons per frame)",
+        default=[1, 5, 10, 20, 40],
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument(
+        "-r", "--repeat", help="The number of measurements per stage", default=50, type=int
+    )
+    parser.add_argument(
+        "-w", "--warmup", help="The number of warm-up runs per stage", default=5, type=int
+    )
+    parser.add_argument(
+        "-d",
+        "--device",
+        help="Specify the target device to infer on",
+        default="CPU",
+        type=str,
+    )
+    parser.add_argument(
+        "--no_models",
+        help="Skip the stages which need OpenVINO models",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-o", "--output", help="Path to write results (json)", default=None, type=str
+    )
+    return parser
+
+
+def measure(func, repeat, warmup):
+    # Return latency percentiles (ms) of func
+    for _ in range(warmup):
+        func()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = timer()
+        func()
+        times[i] = timer() - start
+    times *= 1000
+    return {
+        "mean_ms": round(float(times.mean()), 4),
+        "p50_ms": round(float(np.percentile(times, 50)), 4),
+        "p90_ms": round(float(np.percentile(times, 90)), 4),
+        "p99_ms": round(float(np.percentile(times, 99)), 4),
+        "repeat": repeat,
+    }
+
+
+class Scene:
+    # Synthetic scene: n persons walking on a grid without overlapping,
+    # each of them with its own feature vector
+    def __init__(self, n, frame_shape=FRAME_SHAPE, seed=0):
+        rng = np.random.default_rng(seed)
+        frame_h, frame_w = frame_shape[:2]
+        cols = int(np.ceil(np.sqrt(n * frame_w / frame_h)))
+        rows = int(np.ceil(n / cols))
+        step_x, step_y = frame_w // (cols + 1), frame_h // (rows + 1)
+        idx = np.arange(n)
+        self.origins = np.stack(
+            [(idx % cols + 1) * step_x, (idx // cols + 1) * step_y], axis=1
+        )
+        self.velocity = rng.uniform(-0.5, 0.5, (n, 2))
+        self.feature_vecs = rng.standard_normal((n, FEATURE_DIM)).astype(np.float32)
+        self.frame = np.zeros(frame_shape, dtype=np.uint8)
+        self.rng = rng
+
+    def boxes(self, t):
+        centers = self.origins + self.velocity * t
+        boxes = np.empty((len(centers), 4))
+        boxes[:, 0] = centers[:, 0] - BOX_W / 2
+        boxes[:, 1] = centers[:, 1] - BOX_H / 2
+        boxes[:, 2] = centers[:, 0] + BOX_W / 2
+        boxes[:, 3] = centers[:, 1] + BOX_H / 2
+        return boxes.astype(int)
+
+    def persons(self, t):
+        # person detection output with the [N, 7] shape
+        frame_h, frame_w = self.frame.shape[:2]
+        boxes = self.boxes(t) / np.array([frame_w, frame_h, frame_w, frame_h])
+        persons = np.zeros((len(boxes), 7), dtype=np.float32)
+        persons[:, 1] = 1
+        persons[:, 2] = 0.9
+        persons[:, 3:7] = boxes
+        return persons
+
+    def noisy_feature_vecs(self):
+        noise = self.rng.standard_normal(self.feature_vecs.shape) * 0.1
+        return self.feature_vecs + noise.astype(np.float32)
+
+
+class SceneReIdentification:
+    # Stand-in for PersonReIdentification which returns the scene's feature vectors
+    def __init__(self, scene):
+        self.scene = scene
+
+    def infer_batch(self, person_frames):
+        return self.scene.noisy_feature_vecs()[: len(person_frames)]
+
+    infer_async = infer_batch
+
+
+def bench_tracker(scene, repeat, warmup):
+    # Measure steady-state person_reidentification: tracks of all persons are
+    # confirmed during warm-up frames before the measurement.
+    tracker = Tracker(SceneReIdentification(scene), scene.frame, 0)
+    t = 0
+
+    def step():
+        nonlocal t
+        t += 1
+        tracker.frame_id = t
+        person_frames, boxes, _ = get_person_frames(scene.persons(t), scene.frame)
+        tracker.person_reidentification(person_frames, boxes)
+
+    return measure(step, repeat, warmup + 10)
+
+
+def load_models(device):
+    # OpenVINO is imported only when the models are benchmarked
+    from libs.interactive_detection import Detectors
+
+    models = Detectors([device, device])
+    if not models.is_reid_ready(wait=True):
+        raise RuntimeError("person re-identification model is not available")
+    return models
+
+
+def bench_models(args, models, scene, n, results):
+    person_detector = models.person_detector
+    person_id_detector = models.person_id_detector
+
+    frame = np.random.default_rng(0).integers(0, 255, FRAME_SHAPE, dtype=np.uint8)
+    person_frames, boxes, _ = get_person_frames(scene.persons(0), frame)
+    tracker = Tracker(person_id_detector, frame, 0)
+    # PersonDetection preprocesses into the reused input buffer of a request (only a
+    # copy of the raw frame when the model does it by itself with model_preprocess)
+    input_buffer = person_detector.create_input_buffer(frame.shape)
+
+    def detection():
+        person_detector.infer(frame, False)
+        person_detector.get_results(False, 0.5)
+
+    stages = {
+        "preprocess": lambda: person_detector.preprocess_into(frame, input_buffer),
+        "detection_inference": detection,
+        "get_feature_vecs": lambda: tracker.get_feature_vecs(person_frames),
+    }
+    for stage, func in stages.items():
+        results.append({"stage": stage, "n": n, **measure(func, args.repeat, args.warmup)})
+
+
+def main(args):
+    models = None if args.no_models else load_models(args.device)
+    results = []
+    for n in args.sizes:
+        scene = Scene(n)
+        persons = scene.persons(0)
+        boxes = scene.boxes(0)
+        track_vecs = scene.noisy_feature_vecs()
+        feature_vecs = scene.noisy_feature_vecs()
+        cost_matrix = 1 - cos_similarity(feature_vecs, track_vecs)
+        # the tracker keeps normalized vectors in the gallery
+        gallery = l2_normalize(track_vecs)
+
+        stages = {
+            "crop_extraction": lambda: get_person_frames(persons, scene.frame),
+            "cos_similarity": lambda: cos_similarity(feature_vecs, track_vecs),
+            "normalized_similarity": lambda: l2_normalize(feature_vecs) @ gallery.T,
+            "iou_matrix": lambda: get_iou_matrix(boxes, boxes),
+        }
+        for name, solver in ASSIGNMENT_SOLVERS.items():
+            stages[name] = lambda solver=solver: solver(cost_matrix)
+        for stage, func in stages.items():
+            results.append(
+                {"stage": stage, "n": n, **measure(func, args.repeat, args.warmup)}
+            )
+        results.append(
+            {
+                "stage": "person_reidentification",
+                "n": n,
+                **bench_tracker(scene, args.repeat, args.warmup),
+            }
+        )
+        if models is not None:
+            bench_models(args, models, scene, n, results)
+
+    print(f"{'stage':<26}{'n':>5}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}  (ms)")
+    for r in results:
+        print(
+            f"{r['stage']:<26}{r['n']:>5}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}"
+            f"{r['p90_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+        )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "sizes": args.sizes,
+            "device": None if args.no_models else args.device,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(build_argparser().parse_args())
@@ -0,0 +1,167 @@
+"""Headless batch mode
+
+Process a video file as fast as possible without GUI and drawing, and write
+tracks and summary stats of the video into the output directory.
+
+ex. python headless.py -i video/TownCentreXVID.mp4 -o output
+    python headless.py -i video/TownCentreXVID.mp4 --record TownCentre.rec
+    python headless.py -i TownCentre.rec --replay
+"""
+import configparser
+import csv
+import json
+import os
+import sys
+from logging import getLogger, DEBUG, INFO
+from timeit import default_timer as timer
+
+import numpy as np
+
+from libs.argparser import build_headless_argparser
+from libs.log_utils import setup_logging
+from libs.recorder import DetectionRecorder, DetectionReplayer
+from libs.tracker import Tracker
+
+logger = getLogger(__name__)
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+resize_width = int(config.get("CAMERA", "resize_width"))
+
+TRACK_FIELDS = ["frame_id", "id", "xmin", "ymin", "xmax", "ymax", "confidence"]
+
+
+def get_output_paths(args):
+    os.makedirs(args.output, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.input))[0]
+    tracks_path = os.path.join(args.output, f"{name}_tracks.csv")
+    summary_path = os.path.join(args.output, f"{name}_summary.json")
+    return tracks_path, summary_path
+
+
+def write_tracks(writer, frame_id, person_info):
+    for person in person_info:
+        xmin, ymin, xmax, ymax = person["bbox"]
+        writer.writerow(
+            [frame_id, person["id"], xmin, ymin, xmax, ymax, person["confidence"]]
+        )
+
+
+def write_summary(summary_path, args, frames, elapsed, tracker, det_time, reid_time):
+    summary = {
+        "input": args.input,
+        "frames": frames,
+        "elapsed_sec": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        "det_time_ms": round(det_time * 1000 / max(frames, 1), 3),
+        "reid_time_ms": round(reid_time * 1000 / max(frames, 1), 3),
+        "persons": tracker.person_id,
+        "tracks": len(tracker.tracks),
+        "counter_stats": tracker.line_counter.get_counts(),
+    }
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    logger.info(f"summary:{summary}")
+    print(json.dumps(summary, indent=2))
+
+
+def run(args):
+    # OpenVINO is imported only when the models are used
+    from libs.camera import VideoCamera
+    from libs.interactive_detection import Detections
+
+    is_det = True
+    is_reid = not args.det_only
+    devices = [args.device, args.device_reidentification]
+
+    camera = VideoCamera(args.input, resize_width, args.v4l)
+    detections = Detections(camera.frame, devices, args.grid)
+    if is_reid and not detections.is_reid_ready(wait=True):
+        logger.error("person re-identification model is not available")
+        return 1
+    if args.record:
+        feature_dim = detections.person_id_detector.feature_dim if is_reid else 256
+        detections.recorder = DetectionRecorder(
+            args.record, camera.frame.shape, feature_dim
+        )
+
+    tracks_path, summary_path = get_output_paths(args)
+    frame_id = 0
+    det_time_det, det_time_reid = 0.0, 0.0
+    start = timer()
+
+    with open(tracks_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TRACK_FIELDS)
+
+        while True:
+            frame = camera.get_frame(None)
+            if frame is None:
+                break
+            frame_id += 1
+            # the results are not rendered
+            _, person_info = detections.person_detection(
+                frame, True, is_det, is_reid, str(frame_id)
+            )
+            write_tracks(writer, detections.tracker.frame_id, person_info)
+            det_time_det += detections.det_time_det
+            det_time_reid += detections.det_time_reid
+
+        # frames left in the detection pipeline
+        for _, person_info in detections.flush_detection(is_det, is_reid):
+            write_tracks(writer, detections.tracker.frame_id, person_info)
+            det_time_reid += detections.det_time_reid
+
+    if detections.recorder is not None:
+        detections.recorder.close()
+
+    elapsed = timer() - start
+    write_summary(
+        summary_path, args, frame_id, elapsed, detections.tracker, det_time_det, det_time_reid
+    )
+    return 0
+
+
+def replay(args):
+    # Feed recorded detections into the tracker without models and video
+    replayer = DetectionReplayer(args.input)
+    frame = np.zeros(replayer.frame_shape, dtype=np.uint8)
+    tracker = Tracker(None, frame, args.grid)
+
+    tracks_path, summary_path = get_output_paths(args)
+    frames = 0
+    reid_time = 0.0
+    start = timer()
+
+    with open(tracks_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TRACK_FIELDS)
+
+        for frame_id, boxes, _, feature_vecs in replayer:
+            frames += 1
+            # frames recorded before the re-identification model was loaded
+            if len(boxes) and not len(feature_vecs):
+                continue
+            tracker.frame_id = frame_id
+            inf_start = timer()
+            person_info, _ = tracker.person_reidentification(
+                None, boxes, feature_vecs
+            )
+            reid_time += timer() - inf_start
+            write_tracks(writer, frame_id, person_info)
+
+    elapsed = timer() - start
+    write_summary(summary_path, args, frames, elapsed, tracker, 0.0, reid_time)
+    return 0
+
+
+if __name__ == "__main__":
+    args = build_headless_argparser().parse_args()
+    level = DEBUG if args.verbose else INFO
+    setup_logging(
+        "headless.log",
+        level=level,
+        format="%(asctime)s %(levelname)s %(name)s %(funcName)s:%(lineno)d %(message)s",
+    )
+    sys.exit(replay(args) if args.replay else run(args))
@@ -0,0 +1,287 @@
+"""Approximate nearest neighbour index of feature vectors
+
+IVFIndex is an inverted file index for L2-normalized feature vectors compared by
+cosine similarity (inner product). The vectors are clustered by spherical k-means,
+and a query is compared only with the vectors in the n_probe clusters whose
+centroids are the most similar to it, instead of all of them.
+
+Until train_size vectors are added the index is a single list searched exhaustively
+(exact). The clusters are trained at train_size vectors and re-trained each time the
+number of vectors becomes 4 times as many as at the last training. Removed vectors
+are marked as deleted (tombstones) and dropped when the lists are rebuilt.
+
+Training and rebuilding the lists take seconds for 100k vectors, so they run in a
+background thread from a snapshot of the vectors (background=True). Until the new
+lists are ready, vectors are added to and removed from the current lists. The new
+lists are swapped in by the next call of add, remove or search, after the changes
+made since the snapshot are applied to them.
+"""
+import threading
+from logging import getLogger
+
+import numpy as np
+
+from libs.gallery import FeatureGallery
+
+logger = getLogger(__name__)
+
+
+def kmeans(X, n_clusters, n_iter=10, seed=0):
+    """
+    Spherical k-means of L2-normalized vectors
+
+    :param: X: vectors with the [N, D] shape (N >= n_clusters)
+    :returns:
+            centroids: L2-normalized centroids with the [n_clusters, D] shape
+    """
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        labels = np.argmax(X @ centroids.T, axis=1)
+        # sum the vectors of each cluster at once over the vectors sorted by cluster
+        counts = np.bincount(labels, minlength=n_clusters)
+        starts = np.cumsum(counts) - counts
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(X[np.argsort(labels, kind="stable")], starts[~empty])
+        # re-seed empty clusters with random vectors
+        sums[empty] = X[rng.choice(len(X), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(X.dtype)
+
+
+class InvertedList:
+    # feature vectors of a cluster and their keys. Deleted rows have the key -1.
+    def __init__(self, feature_dim):
+        self.vecs = FeatureGallery(feature_dim)
+        self.keys = np.full(len(self.vecs.data), -1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.vecs)
+
+    def _reserve_keys(self):
+        if len(self.keys) < len(self.vecs.data):
+            keys = np.full(len(self.vecs.data), -1, dtype=np.int64)
+            keys[: len(self.keys)] = self.keys
+            self.keys = keys
+
+    def add(self, key, vec) -> int:
+        row = self.vecs.append(vec)
+        self._reserve_keys()
+        self.keys[row] = key
+        return row
+
+    def extend(self, keys, vecs) -> np.ndarray:
+        # Add the vectors at once and return their rows
+        start = len(self.vecs)
+        self.vecs.extend(vecs)
+        self._reserve_keys()
+        self.keys[start: start + len(keys)] = keys
+        return np.arange(start, start + len(keys))
+
+
+class IVFIndex:
+    def __init__(
+        self, feature_dim, n_lists=None, n_probe=8, train_size=1024, seed=0, background=True
+    ):
+        """
+        :param: feature_dim: dimension of the feature vectors
+        :param: n_lists: the number of clusters (default: sqrt of the number of vectors)
+        :param: n_probe: the number of clusters searched by a query
+        :param: train_size: the number of vectors to train the clusters first
+        :param: background: train and rebuild the lists in a background thread
+        """
+        self.feature_dim = feature_dim
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self.lists = [InvertedList(feature_dim)]
+        # key -> (list_id, row)
+        self.locations = {}
+        self.n_deleted = 0
+        self.background = background
+        # thread which builds the new lists, its result and the keys added or removed
+        # since its snapshot
+        self.builder = None
+        self.built = None
+        self.changed = set()
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def _nearest_list(self, vec) -> int:
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vec))
+
+    def add(self, key, vec):
+        # Add (or replace) the feature vector of the key
+        self._swap_if_built()
+        if key in self.locations:
+            self.remove(key)
+        vec = np.asarray(vec, dtype=np.float32).reshape(self.feature_dim)
+        list_id = self._nearest_list(vec)
+        row = self.lists[list_id].add(key, vec)
+        self.locations[key] = (list_id, row)
+
+        if self.builder is not None:
+            self.changed.add(key)
+        elif len(self) >= max(self.train_size, 4 * self.trained_size):
+            self.rebuild(train=True)
+        elif self.n_deleted > len(self):
+            self.rebuild(train=False)
+
+    def remove(self, key):
+        # Mark the feature vector of the key as deleted
+        self._swap_if_built()
+        list_id, row = self.locations.pop(key)
+        self.lists[list_id].keys[row] = -1
+        self.n_deleted += 1
+        if self.builder is not None:
+            self.changed.add(key)
+
+    def get_items(self):
+        # keys and feature vectors which are not deleted
+        keys = [lst.keys[: len(lst)] for lst in self.lists]
+        vecs = [lst.vecs.vecs for lst in self.lists]
+        keys, vecs = np.concatenate(keys), np.concatenate(vecs)
+        valid = keys >= 0
+        return keys[valid], vecs[valid]
+
+    def rebuild(self, train=False):
+        # Re-assign the vectors to new lists without tombstones (and train the clusters)
+        # With background, the new lists are built from a snapshot in a thread and
+        # swapped in later.
+        keys, vecs = self.get_items()
+        if train:
+            self.trained_size = len(keys)
+        if not self.background:
+            self._swap(*self._build(keys, vecs, train, self.centroids))
+            return
+        self.changed = set()
+        self.builder = threading.Thread(
+            target=self._build_in_background,
+            args=(keys, vecs, train, self.centroids),
+            daemon=True,
+        )
+        self.builder.start()
+
+    def _build_in_background(self, keys, vecs, train, centroids):
+        try:
+            self.built = self._build(keys, vecs, train, centroids)
+        except Exception:
+            logger.exception("failed to rebuild the lists")
+
+    def _build(self, keys, vecs, train, centroids):
+        # Return the centroids, lists and locations of the vectors
+        if train:
+            n_lists = self.n_lists or int(np.sqrt(len(keys)))
+            n_lists = max(1, min(n_lists, len(keys)))
+            # at most 256 vectors per cluster are enough to train
+            rng = np.random.default_rng(self.seed)
+            n_samples = min(len(keys), 256 * n_lists)
+            samples = vecs[rng.choice(len(keys), n_samples, replace=False)]
+            centroids = kmeans(samples, n_lists, seed=self.seed)
+            logger.info(f"trained {n_lists} lists with {n_samples} of {len(keys)} vectors")
+
+        n_lists = 1 if centroids is None else len(centroids)
+        lists = [InvertedList(self.feature_dim) for _ in range(n_lists)]
+        locations = {}
+        self._assign(keys, vecs, centroids, lists, locations)
+        return centroids, lists, locations
+
+    def _assign(self, keys, vecs, centroids, lists, locations):
+        # Add the vectors to the lists of their nearest centroids, a list at once
+        list_ids = (
+            np.zeros(len(keys), dtype=int)
+            if centroids is None
+            else np.argmax(vecs @ centroids.T, axis=1)
+        )
+        order = np.argsort(list_ids, kind="stable")
+        counts = np.bincount(list_ids, minlength=len(lists))
+        starts = np.cumsum(counts) - counts
+        rows = np.empty(len(keys), dtype=int)
+        for list_id in np.flatnonzero(counts).tolist():
+            idx = order[starts[list_id]: starts[list_id] + counts[list_id]]
+            rows[idx] = lists[list_id].extend(keys[idx], vecs[idx])
+        locations.update(zip(keys.tolist(), zip(list_ids.tolist(), rows.tolist())))
+
+    def _swap_if_built(self):
+        # Swap in the lists built in the background when they are ready
+        if self.builder is None or self.builder.is_alive():
+            return
+        self.builder = None
+        built, self.built = self.built, None
+        if built is None:
+            self.changed = set()
+            return
+        self._swap(*built)
+
+    def _swap(self, centroids, lists, locations):
+        # Apply the changes made since the snapshot to the new lists and replace the
+        # current lists with them
+        n_deleted = 0
+        for key in self.changed:
+            if key in locations:
+                list_id, row = locations.pop(key)
+                lists[list_id].keys[row] = -1
+                n_deleted += 1
+        # the current vectors of the changed keys
+        keys = [key for key in self.changed if key in self.locations]
+        rows = np.array([self.locations[key] for key in keys], dtype=int).reshape(-1, 2)
+        keys = np.array(keys, dtype=np.int64)
+        vecs = np.empty((len(keys), self.feature_dim), dtype=np.float32)
+        for list_id in np.unique(rows[:, 0]).tolist():
+            mask = rows[:, 0] == list_id
+            vecs[mask] = self.lists[list_id].vecs.data[rows[mask, 1]]
+        self._assign(keys, vecs, centroids, lists, locations)
+
+        self.changed = set()
+        self.centroids, self.lists, self.locations = centroids, lists, locations
+        self.n_deleted = n_deleted
+
+    def wait(self):
+        # Wait for the lists being built in the background and swap them in
+        if self.builder is not None:
+            self.builder.join()
+            self._swap_if_built()
+
+    def search(self, vec, k=1):
+        """
+        :param: vec: L2-normalized query vector
+        :returns:
+                keys: keys of the k most similar vectors in descending order
+                similarities: their cosine similarities
+        """
+        self._swap_if_built()
+        vec = np.asarray(vec, dtype=np.float32).reshape(self.feature_dim)
+        if self.centroids is None:
+            list_ids = [0]
+        else:
+            n_probe = min(self.n_probe, len(self.centroids))
+            list_ids = np.argpartition(-(self.centroids @ vec), n_probe - 1)[:n_probe]
+
+        keys, similarities = [], []
+        for list_id in list_ids:
+            lst = self.lists[list_id]
+            if not len(lst):
+                continue
+            keys.append(lst.keys[: len(lst)])
+            similarities.append(lst.vecs.vecs @ vec)
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        keys, similarities = np.concatenate(keys), np.concatenate(similarities)
+        valid = keys >= 0
+        keys, similarities = keys[valid], similarities[valid]
+        if len(keys) > k:
+            top = np.argpartition(-similarities, k - 1)[:k]
+            keys, similarities = keys[top], similarities[top]
+        order = np.argsort(-similarities)
+        return keys[order], similarities[order]
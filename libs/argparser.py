@@ -41,3 +41,31 @@ def build_argparser():
         "-v", "--verbose", help="set logging level Debug", action="store_true"
     )
     return parser
+
+
+def build_headless_argparser():
+    parser = build_argparser()
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Directory to write tracks (csv) and summary stats (json) of the video file",
+        default="output",
+        type=str,
+    )
+    parser.add_argument(
+        "--record",
+        help="Path to record boxes, confidences and feature vectors of each frame",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--replay",
+        help="Replay the record file specified by --input into the tracker without models and video",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--det_only",
+        help="Run person detection only without person re-identification",
+        action="store_true",
+    )
+    return parser
@@ -0,0 +1,66 @@
+"""Assignment solvers for the tracker
+
+Each solver takes a (n_detections, n_tracks) cost matrix, which may be
+rectangular, and returns the matched (det_ids, track_ids) as two index arrays
+of the same length. Detections and tracks which are not in the result are
+unassigned.
+"""
+import numpy as np
+from munkres import Munkres
+from scipy.optimize import linear_sum_assignment
+
+
+def scipy_assignment(cost_matrix):
+    # Compiled Hungarian (Jonker-Volgenant) solver, which accepts rectangular matrices
+    det_ids, track_ids = linear_sum_assignment(cost_matrix)
+    return det_ids, track_ids
+
+
+def greedy_assignment(cost_matrix):
+    # Same result as taking the lowest cost pairs one by one until either side is used
+    # up (not optimal), computed in rounds over numpy arrays: each round assigns all
+    # mutual best pairs (the lowest cost of both the detection and the track), which the
+    # one by one greedy would also take, and removes them from the matrix.
+    # A round is O(nm), and tracking costs usually need a few rounds.
+    dets = np.arange(cost_matrix.shape[0])
+    tracks = np.arange(cost_matrix.shape[1])
+    det_ids, track_ids = [], []
+    while len(dets) and len(tracks):
+        cost = cost_matrix[np.ix_(dets, tracks)]
+        best_tracks = cost.argmin(axis=1)
+        best_dets = cost.argmin(axis=0)
+        mutual = best_dets[best_tracks] == np.arange(len(dets))
+        det_ids.append(dets[mutual])
+        track_ids.append(tracks[best_tracks[mutual]])
+        tracks = np.delete(tracks, best_tracks[mutual])
+        dets = dets[~mutual]
+    if not det_ids:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    det_ids, track_ids = np.concatenate(det_ids), np.concatenate(track_ids)
+    # in the order the one by one greedy takes them (lowest cost first)
+    order = np.argsort(cost_matrix[det_ids, track_ids], kind="stable")
+    return det_ids[order], track_ids[order]
+
+
+def munkres_assignment(cost_matrix):
+    # Pure python Hungarian algorithm (previous behavior)
+    indexes = Munkres().compute(cost_matrix.tolist())
+    if not indexes:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    det_ids, track_ids = np.array(indexes, dtype=int).T
+    return det_ids, track_ids
+
+
+ASSIGNMENT_SOLVERS = {
+    "scipy": scipy_assignment,
+    "greedy": greedy_assignment,
+    "munkres": munkres_assignment,
+}
+
+
+def get_assignment_solver(name):
+    if name not in ASSIGNMENT_SOLVERS:
+        raise ValueError(
+            f"unknown assignment solver:{name} (choose from {list(ASSIGNMENT_SOLVERS)})"
+        )
+    return ASSIGNMENT_SOLVERS[name]
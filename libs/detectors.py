@@ -1,33 +1,105 @@
 import cv2
 import numpy as np
+import threading
+from collections import deque
 from logging import getLogger
 
-from openvino.runtime import Core
+from openvino.runtime import AsyncInferQueue, Core, Dimension, PartialShape
+from openvino.runtime import Layout, Type
 import openvino.runtime as ov
 from openvino.runtime import get_version
+from openvino.preprocess import ColorFormat, PrePostProcessor, ResizeAlgorithm
 
 logger = getLogger(__name__)
 
+# OpenVINO Core shared by all the detectors
+_core = None
+_core_lock = threading.Lock()
+
+
+def get_core():
+    global _core
+    with _core_lock:
+        if _core is None:
+            _core = Core()
+    return _core
+
+
+def enable_model_cache(cache_dir):
+    # Save compiled models into cache_dir and import them at the next start
+    # instead of compiling them again.
+    get_core().set_property({"CACHE_DIR": cache_dir})
+    logger.info(f"model cache dir:{cache_dir}")
+
 
 class BaseDetection(object):
-    def __init__(self, device, model_xml, detection_of):
+    def __init__(
+        self,
+        device,
+        model_xml,
+        detection_of,
+        max_batch=1,
+        config=None,
+        model_preprocess=False,
+    ):
 
-        ie = Core()
+        ie = get_core()
         # read the network and corresponding weights from file
         model = ie.read_model(model=model_xml)
 
-        # compile the model for the CPU (you can choose manually CPU, GPU, MYRIAD etc.)
-        # or let the engine choose the best available device (AUTO)
-        self.compiled_model = ie.compile_model(model=model, device_name=device)
+        # get input shape
+        n, c, h, w = model.input(0).shape
+        self.shape = (w, h)
+        # scratch buffer for resize and color conversion in preprocess_into
+        self.resize_buffer = np.empty((h, w, c), dtype=np.uint8)
+
+        # reshape the batch dimension to a dynamic range (1 ~ max_batch).
+        # dynamic shapes are supported by the CPU plugin only, so the other
+        # devices keep the static batch size of the IR.
+        self.max_batch = max_batch if device == "CPU" else 1
+        if self.max_batch > 1:
+            model.reshape(
+                {0: PartialShape([Dimension(1, self.max_batch), c, h, w])})
+
+        # build resize, color conversion and layout change into the model
+        self.model_preprocess = model_preprocess
+        if self.model_preprocess:
+            model = self._build_preprocess(model)
 
         # get input node
         self.input_layer_ir = model.input(0)
-        n, c, h, w = self.input_layer_ir.shape
-        self.shape = (w, h)
+
+        # compile the model for the CPU (you can choose manually CPU, GPU, MYRIAD etc.)
+        # or let the engine choose the best available device (AUTO)
+        self.compiled_model = ie.compile_model(
+            model=model, device_name=device, config=config or {})
         logger.info(
             f"Loading {device} model to the {detection_of} ... version:{get_version()}"
         )
 
+    def warm_up(self):
+        # Run an inference with a blank frame so that the first frame
+        # doesn't take the time of the first inference.
+        w, h = self.shape
+        input_buffer = self.create_input_buffer((h, w, 3))
+        input_buffer.fill(0)
+        self.compiled_model.create_infer_request().infer({0: input_buffer})
+
+    def _build_preprocess(self, model):
+        """
+        Embed the preprocess steps into the model with PrePostProcessor.
+        The input tensor is the RGB uint8 frame (NHWC) with any height and width.
+        """
+        ppp = PrePostProcessor(model)
+        ppp.input().tensor().set_element_type(Type.u8).set_layout(
+            Layout("NHWC")
+        ).set_spatial_dynamic_shape().set_color_format(ColorFormat.RGB)
+        ppp.input().preprocess().convert_element_type(Type.f32).convert_color(
+            ColorFormat.BGR
+        ).resize(ResizeAlgorithm.RESIZE_LINEAR)
+        ppp.input().model().set_layout(Layout("NCHW"))
+        return ppp.build()
+
     def preprocess(self, frame):
         """
          Define the preprocess function for input data
@@ -36,6 +108,10 @@ class BaseDetection(object):
         :returns:
                 resized_image: the image processed
         """
+        if self.model_preprocess:
+            # the model resizes and converts the raw frame by itself
+            return np.expand_dims(np.ascontiguousarray(frame), axis=0)
+
         resized_frame = cv2.resize(frame, self.shape)
         resized_frame = cv2.cvtColor(
             np.array(resized_frame), cv2.COLOR_BGR2RGB)
@@ -44,60 +120,159 @@ class BaseDetection(object):
             resized_frame, axis=0).astype(np.float32)
         return resized_frame
 
+    def create_input_buffer(self, frame_shape):
+        # Allocate an input buffer which is reused by preprocess_into
+        if self.model_preprocess:
+            return np.empty((1,) + tuple(frame_shape), dtype=np.uint8)
+        w, h = self.shape
+        return np.empty((1, 3, h, w), dtype=np.float32)
+
+    def preprocess_into(self, frame, input_buffer):
+        """
+         Same as preprocess, but write the result into the preallocated input buffer
+         without allocating temporary arrays.
+
+        :param: frame: the orignal input frame
+        :param: input_buffer: the buffer created by create_input_buffer
+        :returns:
+                input_buffer: the buffer with the image processed
+        """
+        if self.model_preprocess:
+            np.copyto(input_buffer[0], frame)
+            return input_buffer
+
+        cv2.resize(frame, self.shape, dst=self.resize_buffer)
+        cv2.cvtColor(self.resize_buffer, cv2.COLOR_BGR2RGB,
+                     dst=self.resize_buffer)
+        # cast uint8 to float32 and change the layout HWC -> CHW at once
+        np.copyto(input_buffer[0], self.resize_buffer.transpose((2, 0, 1)))
+        return input_buffer
+
 
 class PersonDetection(BaseDetection):
-    def __init__(self, device, model_xml):
+    def __init__(self, device, model_xml, model_preprocess=False, num_requests=2):
         detection_of = "Person Detection"
-        super().__init__(device, model_xml, detection_of)
+        # keep all cores busy with num_requests requests in flight
+        config = None
+        if num_requests > 2:
+            config = {
+                "PERFORMANCE_HINT": "THROUGHPUT",
+                "PERFORMANCE_HINT_NUM_REQUESTS": str(num_requests),
+            }
+            if device == "CPU":
+                config["NUM_STREAMS"] = str(num_requests)
+        super().__init__(
+            device,
+            model_xml,
+            detection_of,
+            config=config,
+            model_preprocess=model_preprocess,
+        )
 
-        # Create 2 infer requests
-        self.curr_request = self.compiled_model.create_infer_request()
-        self.next_request = self.compiled_model.create_infer_request()
+        # Create infer requests. Each of them owns an input buffer which is
+        # allocated at the first frame and reused afterwards.
+        # idle_requests: [infer request, input buffer]
+        # inflight     : ([infer request, input buffer], frame, frame_id) in frame order
+        self.num_requests = num_requests
+        self.idle_requests = deque(
+            [self.compiled_model.create_infer_request(), None]
+            for _ in range(num_requests)
+        )
+        self.inflight = deque()
 
-    def infer(self, frame, next_frame, is_async):
+    def _set_input(self, request, input_buffer, frame):
+        # Allocate the buffer and share it with the request only when it does not
+        # exist yet or the frame shape changed (model_preprocess takes the raw frame)
+        if input_buffer is None or (
+            self.model_preprocess and input_buffer.shape[1:] != frame.shape
+        ):
+            input_buffer = self.create_input_buffer(frame.shape)
+            request.set_tensor(
+                self.input_layer_ir, ov.Tensor(input_buffer, shared_memory=True)
+            )
+        self.preprocess_into(frame, input_buffer)
+        return input_buffer
+
+    def infer(self, frame, is_async, frame_id=None):
         """
+        Start an inference request of the frame and put it into the pipeline.
+        The frame and frame_id are returned with the results by get_results.
+
         Ref: async api
         https://github.com/openvinotoolkit/openvino_notebooks/blob/2022.1/notebooks/115-async-api/115-async-api.ipynb
         """
+        slot = self.idle_requests.popleft()
+        request, input_buffer = slot
+        slot[1] = self._set_input(request, input_buffer, frame)
+        request.start_async()
+        self.inflight.append((slot, frame, frame_id))
 
-        if is_async:
-            resized_frame = self.preprocess(next_frame)
-            self.next_request.set_tensor(
-                self.input_layer_ir, ov.Tensor(resized_frame))
-            # Start the "next" inference request
-            self.next_request.start_async()
-
-        else:
-            self.curr_request.wait_for(-1)
-            resized_frame = self.preprocess(frame)
-            self.curr_request.set_tensor(
-                self.input_layer_ir, ov.Tensor(resized_frame))
-            # Start the current inference request
-            self.curr_request.start_async()
+    def _pop_results(self, prob_threshold_person):
+        # Wait for the oldest request and give it back to the idle requests
+        slot, frame, frame_id = self.inflight.popleft()
+        request = slot[0]
+        request.wait()
+        res = request.get_output_tensor(0).data
+        # res's shape: [1, 1, 200, 7] -> persons's shape: [N, 7]
+        persons = res[0, 0][res[0, 0, :, 2] > prob_threshold_person]
+        self.idle_requests.append(slot)
+        return frame, frame_id, persons
 
     def get_results(self, is_async, prob_threshold_person):
         """
         The net outputs a blob with shape: [1, 1, 200, 7]
         The description has the format: [image_id, label, conf, x_min, y_min, x_max, y_max]
+
+        async mode: return the oldest frame in flight once num_requests frames are in flight
+        sync mode : return the latest frame (older frames in flight are dropped)
+
+        :returns:
+                frame, frame_id, persons: (None, None, None) until the pipeline is filled
         """
-        persons = None
-        if self.curr_request.wait_for(-1) == 1:
-            res = self.curr_request.get_output_tensor(0).data
-            # res's shape: [1, 1, 200, 7]
-            persons = res[0][:, np.where(
-                res[0][0][:, 2] > prob_threshold_person)]
+        if is_async and len(self.inflight) < self.num_requests:
+            return None, None, None
 
-        if is_async:
-            self.curr_request, self.next_request = self.next_request, self.curr_request
+        if not is_async:
+            while len(self.inflight) > 1:
+                self._pop_results(prob_threshold_person)
 
-        return persons
+        return self._pop_results(prob_threshold_person)
+
+    def get_remaining_results(self, prob_threshold_person):
+        # Drain the pipeline at the end of a stream in frame order
+        while self.inflight:
+            yield self._pop_results(prob_threshold_person)
 
 
 class PersonReIdentification(BaseDetection):
-    def __init__(self, device, model_xml):
+    def __init__(
+        self, device, model_xml, max_batch=1, num_requests=1, model_preprocess=False
+    ):
         detection_of = "Person re-identifications"
-        super().__init__(device, model_xml, detection_of)
+        # let the device decide the number of streams for the parallel requests
+        config = None
+        if num_requests > 1:
+            config = {
+                "PERFORMANCE_HINT": "THROUGHPUT",
+                "PERFORMANCE_HINT_NUM_REQUESTS": str(num_requests),
+            }
+        super().__init__(
+            device, model_xml, detection_of, max_batch, config, model_preprocess
+        )
         self.infer_request = self.compiled_model.create_infer_request()
+        # the length of a descriptor (ex. 256)
+        self.feature_dim = self.compiled_model.output(0).get_partial_shape()[
+            1].get_length()
+
+        # Create a pool of asynchronous infer requests for infer_async
+        self.feature_vecs = None
+        self.infer_queue = AsyncInferQueue(self.compiled_model, num_requests)
+        self.infer_queue.set_callback(self._completion_callback)
+
+    def _completion_callback(self, infer_request, det_id):
+        # write the descriptor back into the row of the detection index
+        res = infer_request.get_output_tensor(0).data
+        self.feature_vecs[det_id] = res.reshape(self.feature_dim)
 
     def infer(self, person_frame):
         resized_frame = self.preprocess(person_frame)
@@ -114,5 +289,65 @@ class PersonReIdentification(BaseDetection):
             which can be compared with other descriptors using the cosine distance.
         """
         res = self.infer_request.get_output_tensor(0).data
-        feature_vec = res.reshape(1, 256)
+        feature_vec = res.reshape(1, self.feature_dim)
         return feature_vec
+
+    def infer_batch(self, person_frames):
+        """
+        Infer person frames in chunks of max_batch instead of one request per person frame
+
+        :param: person_frames: list of the cropped person frames
+        :returns:
+                feature_vecs: descriptors with the (N, feature_dim) shape
+        """
+        feature_vecs = np.empty(
+            (len(person_frames), self.feature_dim), dtype=np.float32)
+
+        for start in range(0, len(person_frames), self.max_batch):
+            batch = person_frames[start:start + self.max_batch]
+            input_data = self._batch_input(batch)
+            self.infer_request.set_tensor(
+                self.input_layer_ir, ov.Tensor(input_data))
+            self.infer_request.infer()
+            res = self.infer_request.get_output_tensor(0).data
+            feature_vecs[start:start + len(batch)] = res.reshape(
+                len(batch), self.feature_dim)
+
+        return feature_vecs
+
+    def _batch_input(self, person_frames):
+        # Stack person frames into one input blob
+        w, h = self.shape
+        if self.model_preprocess:
+            # person frames in a batch need the same shape, so only resize them here.
+            # color conversion and layout change are done in the model.
+            input_data = np.empty((len(person_frames), h, w, 3), dtype=np.uint8)
+            for i, person_frame in enumerate(person_frames):
+                cv2.resize(person_frame, self.shape, dst=input_data[i])
+        else:
+            input_data = np.empty(
+                (len(person_frames), 3, h, w), dtype=np.float32)
+            for i, person_frame in enumerate(person_frames):
+                input_data[i] = self.preprocess(person_frame)[0]
+        return input_data
+
+    def infer_async(self, person_frames):
+        """
+        Infer person frames with the pool of asynchronous infer requests.
+        Preprocessing of the next person frame overlaps with the running requests.
+
+        :param: person_frames: list of the cropped person frames
+        :returns:
+                feature_vecs: descriptors with the (N, feature_dim) shape
+        """
+        self.feature_vecs = np.empty(
+            (len(person_frames), self.feature_dim), dtype=np.float32)
+
+        for det_id, person_frame in enumerate(person_frames):
+            resized_frame = self.preprocess(person_frame)
+            # start_async waits until one of the requests in the pool is idle
+            self.infer_queue.start_async({0: resized_frame}, det_id)
+        self.infer_queue.wait_all()
+
+        feature_vecs, self.feature_vecs = self.feature_vecs, None
+        return feature_vecs
@@ -0,0 +1,70 @@
+"""Frame broadcast from a single capture thread
+
+The capture thread is the only reader of the camera. It puts each decoded frame into
+FrameBuffer, and the consumer threads (detection, display, zoom) read the frames from
+it instead of decoding their own frames. Each frame has a sequence number (1, 2, ...)
+and the time when it was captured, so that a consumer knows which frame it is looking
+at, and the results of a frame can be matched with the frame itself later.
+
+Frames are shared without copying and are made read-only. A consumer copies the frame
+before drawing into it.
+"""
+import threading
+from timeit import default_timer as timer
+
+
+class FrameBuffer:
+    # Ring buffer of the last capacity frames. A frame older than that is dropped, and
+    # a slow consumer skips to the latest frame.
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.frames = [None] * capacity
+        self.timestamps = [0.0] * capacity
+        self.seq = 0  # sequence number of the latest frame (0: no frame yet)
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, frame) -> int:
+        # Add the frame, wake up the consumers and return its sequence number
+        frame.flags.writeable = False
+        with self.cond:
+            self.seq += 1
+            idx = self.seq % self.capacity
+            self.frames[idx] = frame
+            self.timestamps[idx] = timer()
+            self.cond.notify_all()
+            return self.seq
+
+    def close(self):
+        # End of stream: wake up the consumers waiting for a frame
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _item(self, seq):
+        idx = seq % self.capacity
+        return seq, self.timestamps[idx], self.frames[idx]
+
+    def get(self, seq):
+        # (seq, timestamp, frame) of the sequence number, or None when the frame has
+        # been dropped or not captured yet
+        with self.cond:
+            if not self.seq - self.capacity < seq <= self.seq or seq <= 0:
+                return None
+            return self._item(seq)
+
+    def wait(self, last_seq=0, timeout=None):
+        """
+        Wait for a frame newer than last_seq
+
+        :param: last_seq: sequence number of the last frame the consumer read
+        :param: timeout: seconds to wait (None: until a frame or the end of stream)
+        :returns:
+                (seq, timestamp, frame) of the latest frame, or None on timeout or at
+                the end of stream (closed)
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq or self.closed, timeout)
+            if self.seq <= last_seq:
+                return None
+            return self._item(self.seq)
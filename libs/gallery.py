@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class FeatureGallery:
+    # Feature vectors of the tracks (one row per track_id) backed by a preallocated
+    # matrix. The capacity is doubled when it is full, so appending a vector costs
+    # amortized O(1) instead of copying the whole gallery with np.vstack.
+    def __init__(self, feature_dim, capacity=64, dtype=np.float32):
+        self.feature_dim = feature_dim
+        self.data = np.zeros((capacity, feature_dim), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vecs(self):
+        # view of the live rows
+        return self.data[: self.size]
+
+    def __getitem__(self, idx):
+        return self.vecs[idx]
+
+    def __setitem__(self, idx, value):
+        self.vecs[idx] = value
+
+    def _reserve(self, size):
+        capacity = len(self.data)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        data = np.zeros((capacity, self.feature_dim), dtype=self.data.dtype)
+        data[: self.size] = self.vecs
+        self.data = data
+
+    def append(self, vec):
+        # vec: (feature_dim,) or (1, feature_dim). Return the row index of vec.
+        self._reserve(self.size + 1)
+        self.data[self.size] = np.reshape(vec, self.feature_dim)
+        self.size += 1
+        return self.size - 1
+
+    def extend(self, vecs):
+        # vecs: (N, feature_dim)
+        vecs = np.reshape(vecs, (-1, self.feature_dim))
+        self._reserve(self.size + len(vecs))
+        self.data[self.size: self.size + len(vecs)] = vecs
+        self.size += len(vecs)
@@ -1,8 +1,9 @@
 from logging import getLogger
-import cv2
+import threading
 import numpy as np
 from timeit import default_timer as timer
 from libs.tracker import Tracker
+from libs.utils import get_person_frames
 import libs.detectors as detectors
 import configparser
 
@@ -13,20 +14,28 @@ config.read("config.ini")
 
 # probability threshold to detect persons
 prob_thld_person = eval(config.get("DETECTION", "prob_thld_person"))
+# The number of frames in flight in the person detection pipeline
+det_num_requests = eval(config.get("DETECTION", "det_num_requests"))
 
-# basic colors
-green = eval(config.get("COLORS", "green"))
-skyblue = eval(config.get("COLORS", "skyblue"))
+# Max. number of re-identification processes per frame (the batch size of re-id model)
+reid_limit = eval(config.get("TRACKER", "reid_limit"))
+reid_infer_mode = config.get("REIDENTIFICATION", "reid_infer_mode")
+reid_num_requests = eval(config.get("REIDENTIFICATION", "reid_num_requests"))
 
 # OpenVINO Models
 model_path = config.get("MODELS", "model_path")
 model_det = config.get("MODELS", "model_det")
 model_reid = config.get("MODELS", "model_reid")
+model_preprocess = eval(config.get("MODELS", "model_preprocess"))
+cache_dir = config.get("MODELS", "cache_dir")
 
 
 class Detectors:
     def __init__(self, devices):
         self.device_det, self.device_reid = devices
+        # person re-identification is loaded in the background when it is required
+        self.person_id_detector = None
+        self.reid_loader = None
         self._define_models()
         self._load_detectors()
 
@@ -39,14 +48,45 @@ class Detectors:
         self.model_reid = f"{model_path}/{model_reid}/{fp_path}/{model_reid}.xml"
 
     def _load_detectors(self):
+        if cache_dir:
+            detectors.enable_model_cache(cache_dir)
         # person_detection
         self.person_detector = detectors.PersonDetection(
-            self.device_det, self.model_det
+            self.device_det,
+            self.model_det,
+            model_preprocess=model_preprocess,
+            num_requests=det_num_requests,
         )
+        self.person_detector.warm_up()
+
+    def _load_person_id_detector(self):
         # person re-identification
-        self.person_id_detector = detectors.PersonReIdentification(
-            self.device_reid, self.model_reid
-        )
+        try:
+            num_requests = reid_num_requests if reid_infer_mode == "async" else 1
+            person_id_detector = detectors.PersonReIdentification(
+                self.device_reid,
+                self.model_reid,
+                max_batch=reid_limit,
+                num_requests=num_requests,
+                model_preprocess=model_preprocess,
+            )
+            person_id_detector.warm_up()
+            self.person_id_detector = person_id_detector
+        except Exception:
+            logger.exception("failed to load the person re-identification model")
+
+    def is_reid_ready(self, wait=False):
+        # Start loading the person re-identification model at the first call
+        if self.person_id_detector is not None:
+            return True
+        if self.reid_loader is None:
+            self.reid_loader = threading.Thread(
+                target=self._load_person_id_detector, daemon=True
+            )
+            self.reid_loader.start()
+        if wait:
+            self.reid_loader.join()
+        return self.person_id_detector is not None
 
 
 class Detections(Detectors):
@@ -58,12 +98,13 @@ class Detections(Detectors):
         self.curr_fps = 0
         self.fps = "FPS: ??"
         self.prev_time = timer()
-        self.prev_frame = frame
         # create tracker instance
         self.tracker = Tracker(self.person_id_detector, frame, grid)
         # inference time
         self.det_time_det = 0
         self.det_time_reid = 0
+        # libs.recorder.DetectionRecorder to record detections of each frame
+        self.recorder = None
 
     def _calc_fps(self):
         curr_time = timer()
@@ -77,241 +118,139 @@ class Detections(Detectors):
             self.fps = "FPS: " + str(self.curr_fps)
             self.curr_fps = 0
 
-    def draw_bbox(self, frame, box, result, color):
-        xmin, ymin, xmax, ymax = box
-        size = cv2.getTextSize(result, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
-        xtext = xmin + size[0][0] + 20
-        cv2.rectangle(
-            frame, (xmin, ymin - 22), (xtext, ymin), green, -1,
-        )
-        cv2.rectangle(
-            frame, (xmin, ymin - 22), (xtext, ymin), green,
-        )
-        cv2.rectangle(
-            frame, (xmin, ymin), (xmax, ymax), green, 1,
-        )
-        cv2.putText(
-            frame,
-            result,
-            (xmin + 3, ymin - 5),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            (0, 0, 0),
-            1,
-        )
-        return frame
-
-    def draw_perf_stats(
-        self, det_time, det_time_txt, frame, frame_id, is_async, person_counter=None
-    ):
-
-        # Draw FPS on top right corner
-        self._calc_fps()
-        cv2.rectangle(
-            frame, 
-            (frame.shape[1] - 50, 0), 
-            (frame.shape[1], 17), 
-            (255, 255, 255), 
-            -1
-        )
-        cv2.putText(
-            frame,
-            self.fps,
-            (frame.shape[1] - 50 + 3, 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.35,
-            (0, 0, 0),
-            1,
-        )
-        # Draw Real-Time Person Counter on top right corner
-        if person_counter is not None:
-            cv2.rectangle(
-                frame,
-                (frame.shape[1] - 50, 17),
-                (frame.shape[1], 34),
-                (255, 255, 255),
-                -1,
-            )
-            cv2.putText(
-                frame,
-                f"DET: {person_counter}",
-                (frame.shape[1] - 50 + 3, 27),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.35,
-                (0, 0, 0),
-                1,
-            )
-
-        # Draw Frame number at bottom corner
-        cv2.rectangle(
-            frame,
-            (frame.shape[1] - 50, frame.shape[0] - 20),
-            (frame.shape[1], frame.shape[0]),
-            (255, 255, 255),
-            -1,
-        )
-        cv2.putText(
-            frame,
-            frame_id.zfill(5),
-            (frame.shape[1] - 40, frame.shape[0] - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.35,
-            (0, 0, 0),
-            1,
-        )
-
-        # Draw performance stats
-        if is_async:
-            inf_time_message = (
-                f"Total Inference time: {det_time * 1000:.3f} ms for async mode"
-            )
-        else:
-            inf_time_message = (
-                f"Total Inference time: {det_time * 1000:.3f} ms for sync mode"
-            )
-        cv2.putText(
-            frame,
-            inf_time_message,
-            (10, 15),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            (200, 10, 10),
-            1,
-        )
-        if det_time_txt:
-            inf_time_message = (
-                f"@Detection prob:{prob_thld_person} time: {det_time_txt}"
-            )
-            cv2.putText(
-                frame,
-                inf_time_message,
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.4,
-                (200, 10, 10),
-                1,
-            )
-        return frame
-
     def get_person_frames(self, persons, frame):
+        return get_person_frames(persons, frame)
 
-        frame_h, frame_w = frame.shape[:2]
-        person_frames = []
-        boxes = []
-
-        for person in persons[0][0]:
-            box = person[3:7] * np.array([frame_w, frame_h, frame_w, frame_h])
-            xmin, ymin, xmax, ymax = box.astype("int")
-            person_frame = frame[ymin:ymax, xmin:xmax]
-            person_h, person_w = person_frame.shape[:2]
-            # Resizing person_frame will be failed when witdh or height of the person_fame is 0
-            # ex. (243, 0, 3)
-            if person_h != 0 and person_w != 0:
-                boxes.append((xmin, ymin, xmax, ymax))
-                person_frames.append(person_frame)
-
-        return person_frames, boxes
-
-    def person_detection(self, frame, is_async, is_det, is_reid, frame_id, show_track):
-        # Give the frame_id with tracker instance
-        self.tracker.frame_id = frame_id
-        self.tracker.show_track = show_track
+    def get_result(self, frame, frame_id, is_async, is_det, det_time_txt, **kwargs):
+        # Structured result of a frame which libs.renderer.Renderer draws
+        det_time = self.det_time_det + self.det_time_reid
+        result = {
+            "frame": frame,
+            "frame_id": frame_id,
+            "is_async": is_async,
+            "is_det": is_det,
+            "fps": self.fps,
+            "det_time": det_time,
+            "det_time_txt": det_time_txt,
+            "person_counter": None,
+            "boxes": [],
+            "confidences": [],
+            "track_info": None,
+        }
+        result.update(kwargs)
+        return result
+
+    def person_detection(self, frame, is_async, is_det, is_reid, frame_id):
+        # Return the result of the frame and person_info. Nothing is drawn into the
+        # frame: the display thread of the app passes the result to Renderer.render().
+
+        # Use person detection only until the re-identification model is loaded
+        if is_reid:
+            if self.is_reid_ready():
+                self.tracker.person_id_detector = self.person_id_detector
+            else:
+                is_det, is_reid = True, False
 
         # init params
-        det_time = 0
         self.det_time_det = 0
         self.det_time_reid = 0
-        persons = None
-        person_frames = None
-        boxes = None
-        person_counter = 0
-        person_info = None
 
         # just return frame when person detection and person reidentification are False
         if not is_det and not is_reid:
-            self.prev_frame = self.draw_perf_stats(
-                det_time, "Video capture mode", frame, frame_id, is_async
+            self._calc_fps()
+            result = self.get_result(
+                frame, frame_id, is_async, is_det, "Video capture mode"
             )
-            return self.prev_frame, []
+            return result, []
+
+        # ----------- Person Detection ---------- #
+        # Put the frame into the detection pipeline. The oldest frame in the
+        # pipeline is returned together with its frame_id and results.
+        inf_start = timer()
+        self.person_detector.infer(frame, is_async, frame_id)
+        det_frame, det_frame_id, persons = self.person_detector.get_results(
+            is_async, prob_thld_person)
+        inf_end = timer()
+        self.det_time_det = inf_end - inf_start
+
+        # The pipeline is not filled yet
+        if persons is None:
+            return None, []
+
+        return self._process_detections(
+            det_frame, det_frame_id, persons, is_async, is_det, is_reid
+        )
 
-        if is_async:
-            prev_frame = frame.copy()
-        else:
-            self.prev_frame = frame.copy()
+    def flush_detection(self, is_det, is_reid):
+        # Process the frames left in the detection pipeline at the end of a stream
+        for det_frame, det_frame_id, persons in (
+            self.person_detector.get_remaining_results(prob_thld_person)
+        ):
+            self.det_time_det = 0
+            self.det_time_reid = 0
+            yield self._process_detections(
+                det_frame, det_frame_id, persons, True, is_det, is_reid
+            )
 
-        if is_det or is_reid:
+    def _process_detections(self, frame, frame_id, persons, is_async, is_det, is_reid):
+        # Process the frame which matches the results from here on
+        self.tracker.frame_id = frame_id
+        det_time_txt = f"person det:{self.det_time_det * 1000:.3f} ms "
+        person_info = None
+        track_info = None
+
+        person_frames, boxes, confidences = self.get_person_frames(persons, frame)
+        person_counter = len(person_frames)
+        confidence_list = np.round(confidences * 100, 1).tolist()
+        box_list = [tuple(box) for box in boxes.tolist()]
 
-            # ----------- Person Detection ---------- #
+        # ----------- Person ReIdentification ---------- #
+        if is_reid:
             inf_start = timer()
-            self.person_detector.infer(self.prev_frame, frame, is_async)
-            persons = self.person_detector.get_results(
-                is_async, prob_thld_person)
+            person_info, track_info = self.tracker.person_reidentification(
+                person_frames, boxes
+            )
             inf_end = timer()
-            self.det_time_det = inf_end - inf_start
-            det_time_txt = f"person det:{self.det_time_det * 1000:.3f} ms "
-
-            if persons is None:
-                return self.prev_frame, []
-
-            person_frames, boxes = self.get_person_frames(
-                persons, self.prev_frame)
-            person_counter = len(person_frames)
-            confidence_list = []
-
-            if is_det and person_frames:
-                # ----------- Draw result into the frame ---------- #
-                for det_id, person_frame in enumerate(person_frames):
-                    confidence = round(persons[0][0][det_id][2] * 100, 1)
-                    confidence_list.append(confidence)
-                    result = f"{det_id} {confidence}%"
-                    # draw bounding box per each person into the frame
-                    self.prev_frame = self.draw_bbox(
-                        self.prev_frame, boxes[det_id], result, green
-                    )
-
-            # ----------- Person ReIdentification ---------- #
-            if is_reid:
-                inf_start = timer()
-                self.prev_frame, person_info = self.tracker.person_reidentification(
-                    self.prev_frame, person_frames, boxes
-                )
-                inf_end = timer()
-                self.det_time_reid = inf_end - inf_start
-                det_time_txt = det_time_txt + \
-                    f"reid:{self.det_time_reid * 1000:.3f} ms"
-
-            if person_frames is None:
-                det_time_txt = "No persons detected"
+            self.det_time_reid = inf_end - inf_start
+            det_time_txt = det_time_txt + \
+                f"reid:{self.det_time_reid * 1000:.3f} ms"
 
-        det_time = self.det_time_det + self.det_time_reid
-        frame = self.draw_perf_stats(
-            det_time,
-            det_time_txt,
-            self.prev_frame,
+        # ----------- Record detections ---------- #
+        # the feature vectors the tracker matched with (see libs/recorder.py)
+        if self.recorder is not None:
+            feature_vecs = self.tracker.feature_vecs if is_reid else None
+            self.recorder.write(frame_id, boxes, confidences, feature_vecs)
+
+        self._calc_fps()
+        result = self.get_result(
+            frame,
             frame_id,
             is_async,
+            is_det,
+            det_time_txt,
             person_counter=str(person_counter),
+            boxes=box_list,
+            confidences=confidence_list,
+            track_info=track_info,
         )
 
-        if is_async:
-            self.prev_frame = prev_frame
-
         # 可能在 det mode
         if person_info is None:
             person_info = []
             for det_id, person_frame in enumerate(person_frames):
-                bbox = boxes[det_id]
+                bbox = box_list[det_id]
                 confidence = confidence_list[det_id]
                 person_dict = {
                     "id": det_id,
                     "bbox": bbox,
                     "frame": person_frame,
+                    "frame_id": frame_id,
                     "confidence": confidence
                 }
                 person_info.append(person_dict)
 
-        return frame, person_info
-    
+        return result, person_info
+
     def get_det_time(self):
         return self.det_time_det, self.det_time_reid
 
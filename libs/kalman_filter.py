@@ -1,24 +1,17 @@
 import numpy as np
 
 
-class KalmanFilter:
-    def __init__(self, measurement, dt=0.1):
+class BatchKalmanFilter:
+    # Kalman filter of the center and velocity of all tracks at once. The states
+    # (T, 4) and the error covariance matrices (T, 4, 4) of the tracks are stacked, one
+    # row per track_id, and predict/update run for a set of track_ids in a single call.
+    def __init__(self, dt=0.1, capacity=64):
         # Noise
         R_std = 0.35
         Q_std = 0.04
         self.R = np.eye(2) * R_std ** 2
         self.Q = np.eye(4) * Q_std ** 2
-
-        # Initiliza State
-        # 4D state with initial position and initial velocity assigned
-        self.X = np.array([[measurement[0]], [measurement[1]], [0.0], [0.0]])
-
-        # self.Bu = np.zeros((4,4))
-        # self.U = np.array([[0.0], [0.0], [0.0], [0.0]])
-
-        # Initilize Error covariance Matrix
-        gamma = 10
-        self.P = gamma * np.eye(4)
+        self.gamma = 10
 
         # State Transition matrix
         self.A = np.array(
@@ -29,24 +22,55 @@ class KalmanFilter:
                 [0.0, 0.0, 0.0, 1.0],
             ]
         )
-        self.B = np.eye(4)
-        self.C = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
-        # Obtain prior estimates and error covariance from initial values
-
-    def predict(self):
-        # prior state estimate
-        self.X = self.A @ self.X
-        # prior-error covariance matrix
-        self.P = self.A @ self.P @ self.A.T + self.B @ self.Q @ self.B.T
-
-    def update(self, measurement: tuple):
-        # kalman gain
-        self.G = (
-            self.P @ self.C.T @ np.linalg.inv((self.C @ self.P @ self.C.T + self.R))
-        )
+        # B is the identity matrix and C picks the position (x, y) from the state
+
+        self.X = np.zeros((capacity, 4))
+        self.P = np.zeros((capacity, 4, 4))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        capacity = len(self.X)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        X = np.zeros((capacity, 4))
+        P = np.zeros((capacity, 4, 4))
+        X[: self.size] = self.X[: self.size]
+        P[: self.size] = self.P[: self.size]
+        self.X, self.P = X, P
+
+    def add(self, measurement) -> int:
+        # Add the state of a new track and return its index
+        self._reserve(self.size + 1)
+        idx = self.size
+        self.size += 1
+        self.reset(idx, measurement)
+        return idx
+
+    def reset(self, idx, measurement):
+        # Initialize the state with the position and zero velocity
+        self.X[idx] = (measurement[0], measurement[1], 0.0, 0.0)
+        self.P[idx] = self.gamma * np.eye(4)
+
+    def predict(self, ids):
+        # prior state estimate and prior-error covariance matrix
+        self.X[ids] = self.X[ids] @ self.A.T
+        self.P[ids] = self.A @ self.P[ids] @ self.A.T + self.Q
+        return self.X[ids]
+
+    def update(self, ids, measurements):
+        # measurements: (len(ids), 2) positions
+        P = self.P[ids]
+        # kalman gain: P C^T (C P C^T + R)^-1
+        S = P[:, :2, :2] + self.R
+        G = P[:, :, :2] @ np.linalg.inv(S)
         # new state estimate
-        self.X = self.X + self.G @ (
-            np.array(measurement).reshape(-1, 1) - self.C @ self.X
-        )
-        # new-error covariance matrix
-        self.P = (np.eye(self.A.shape[0]) - self.G @ self.C) @ self.P
+        residual = np.asarray(measurements, dtype=float).reshape(-1, 2) - self.X[ids, :2]
+        self.X[ids] = self.X[ids] + (G @ residual[:, :, None])[:, :, 0]
+        # new-error covariance matrix: (I - G C) P
+        self.P[ids] = P - G @ P[:, :2, :]
+        return self.X[ids]
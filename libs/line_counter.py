@@ -0,0 +1,103 @@
+"""Line-crossing counter
+
+A counting line is a polyline (a gate is a polyline of two points) in the pixel
+coordinates of the frame. The last movements of all tracks (from the previous center
+to the current center) are tested against all segments of all lines at once, and the
+crossings are counted per line and per direction:
+
+    in : crossed from the left-hand side to the right-hand side of the line, looking
+         from its first point to its last point on the frame
+    out: crossed the other way
+
+The lines of a closed area listed clockwise on the frame (ex. grid_lines()) count
+the persons who enter the area as "in" and who leave it as "out".
+
+LineCounter finds the crossings and keeps the counters. Which crossings of a track
+are counted (ex. not each time a person standing on a line jitters across it) is
+decided by the caller (Tracker.count_tracks).
+"""
+import numpy as np
+
+DIRECTIONS = ("in", "out")
+
+
+def grid_lines(track_range) -> dict:
+    # The four edges of the counter area of Tracker._set_track_range (clockwise)
+    top_left = track_range["top_left"]
+    top_right = track_range["top_right"]
+    bottom_left = track_range["bottom_left"]
+    bottom_right = track_range["bottom_right"]
+    return {
+        "top": [top_left, top_right],
+        "right": [top_right, bottom_right],
+        "bottom": [bottom_right, bottom_left],
+        "left": [bottom_left, top_left],
+    }
+
+
+def cross(a, b):
+    # z component of the cross product of 2d vectors (broadcasted)
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+class LineCounter:
+    def __init__(self, lines: dict):
+        """
+        :param: lines: {name: [(x, y), ...]} polylines of two or more points
+        """
+        self.lines = {}
+        seg_a, seg_b, seg_line = [], [], []
+        for line_id, (name, points) in enumerate(lines.items()):
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+            if len(points) < 2:
+                raise ValueError(f"counting line {name} needs two or more points")
+            self.lines[name] = [tuple(p) for p in points.astype(int).tolist()]
+            seg_a.append(points[:-1])
+            seg_b.append(points[1:])
+            seg_line.append(np.full(len(points) - 1, line_id))
+        self.names = list(self.lines)
+        # segments of all lines: start points, end points and their line ids
+        self.seg_a = np.concatenate(seg_a) if seg_a else np.empty((0, 2))
+        self.seg_b = np.concatenate(seg_b) if seg_b else np.empty((0, 2))
+        self.seg_line = np.concatenate(seg_line) if seg_line else np.empty(0, dtype=int)
+        # counters with the [lines, DIRECTIONS] shape
+        self.counts = np.zeros((len(self.names), len(DIRECTIONS)), dtype=np.int64)
+
+    def crossings(self, prev_points, points):
+        """
+        Test the movements from prev_points to points against all segments
+
+        :param: prev_points: previous points with the [N, 2] shape (nan: no movement)
+        :param: points: current points with the [N, 2] shape
+        :returns:
+                idx: indices of the points which crossed a segment
+                line_ids: ids of the crossed lines
+                directions: 0 (in) or 1 (out)
+        """
+        p = np.asarray(prev_points, dtype=np.float64).reshape(-1, 1, 2)
+        d = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2) - p
+        e = (self.seg_b - self.seg_a)[None]
+        ap = self.seg_a[None] - p
+        # [N, S] parameters of the intersection on the movement (t) and the segment (u)
+        denom = cross(d, e)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = cross(ap, e) / denom
+            u = cross(ap, d) / denom
+        # The start of a movement and the end of a segment are excluded so that a point
+        # on a line or a vertex of a polyline is counted once. nan never crosses.
+        crossed = (denom != 0) & (t > 0) & (t <= 1) & (u >= 0) & (u < 1)
+        idx, seg_ids = np.nonzero(crossed)
+        # denom < 0: moving to the right-hand side of the segment (in)
+        directions = (denom[idx, seg_ids] > 0).astype(int)
+        return idx, self.seg_line[seg_ids], directions
+
+    def add(self, line_ids, directions):
+        # Count up the crossings of the lines in the directions (see crossings)
+        np.add.at(self.counts, (line_ids, directions), 1)
+
+    def get_counts(self) -> dict:
+        # {name: {"in": n, "out": n}}
+        return {
+            name: dict(zip(DIRECTIONS, counts))
+            for name, counts in zip(self.names, self.counts.tolist())
+        }
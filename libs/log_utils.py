@@ -0,0 +1,92 @@
+"""Logging off the hot path
+
+setup_logging() attaches a QueueHandler to the root logger and writes the records
+to the log file from a QueueListener thread, so that formatting and file writes
+do not block the frame loop.
+
+EventLogger emits compact structured records (event name and fields) which are
+formatted only in the listener thread. Level checks and per-event sampling are
+done before the caller builds any field:
+
+    if events.enabled("update"):
+        events.emit("update", frame_id=frame_id, det_id=det_id)
+"""
+import atexit
+import queue
+from logging import FileHandler, Formatter, INFO, getLogger
+from logging.handlers import QueueHandler, QueueListener
+
+import numpy as np
+
+
+class LazyQueueHandler(QueueHandler):
+    # QueueHandler.prepare() formats the message in the calling thread to make the
+    # record picklable. The queue is in-process, so the record is passed as it is
+    # and its message is formatted by the listener.
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(filename, level=INFO, format=None, filemode="w"):
+    """
+    Write the logs of all loggers to filename through a queue
+
+    :returns:
+            listener: QueueListener which is stopped (flushed) at exit
+    """
+    log_queue = queue.SimpleQueue()
+    file_handler = FileHandler(filename, mode=filemode)
+    file_handler.setFormatter(Formatter(format))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+
+    root = getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class EventMessage:
+    # Structured message which is formatted when the record is written
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        fields = " ".join(
+            f"{k}:{v:.3f}" if isinstance(v, (float, np.floating)) else f"{k}:{v}"
+            for k, v in self.fields.items()
+        )
+        return f"{self.event} {fields}"
+
+
+class EventLogger:
+    def __init__(self, logger, sampling=None):
+        """
+        :param: logger: logger to emit the events
+        :param: sampling: {event: n} emit one of every n events (default: 1)
+        """
+        self.logger = logger
+        self.sampling = sampling or {}
+        self.counts = {}
+
+    def enabled(self, event, level=INFO) -> bool:
+        # Check the level first, then count up the event and sample it
+        if not self.logger.isEnabledFor(level):
+            return False
+        n = self.sampling.get(event, 1)
+        if n <= 1:
+            return True
+        count = self.counts.get(event, 0)
+        self.counts[event] = count + 1
+        return count % n == 0
+
+    def emit(self, event, level=INFO, **fields):
+        # fields must be snapshots (numbers, strings, tuples) as they are formatted later
+        self.logger.log(level, EventMessage(event, fields), stacklevel=2)
@@ -0,0 +1,117 @@
+"""Record and replay detections
+
+DetectionRecorder writes boxes, confidences and feature vectors of each frame
+into a compact binary file, and DetectionReplayer reads them back, so that the
+tracker can be run without OpenVINO models and video decoding.
+
+File format (little endian):
+    header: magic(4s) version(H) feature_dim(H) dtype(H) frame_h(I) frame_w(I)
+    frame : frame_id(q) n_boxes(I) n_vecs(I)
+            boxes       int32   (n_boxes, 4)
+            confidences float32 (n_boxes,)
+            feature_vecs dtype  (n_vecs, feature_dim)
+
+The feature vectors are the ones the tracker matched with (Tracker.feature_vecs),
+not the raw outputs of the re-identification model: they are L2-normalized, and
+with reid_skip the vectors of the skipped detections are the gallery vectors of
+their tracks. A replay reproduces the recorded run of the tracker. To replay the
+re-identification itself (ex. with other reid_skip settings), record with
+reid_skip = False.
+"""
+import struct
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+MAGIC = b"PRID"
+VERSION = 1
+HEADER = struct.Struct("<4sHHHII")
+FRAME_HEADER = struct.Struct("<qII")
+DTYPES = {1: np.float16, 2: np.float32}
+
+
+class DetectionRecorder:
+    def __init__(self, path, frame_shape, feature_dim=256, dtype=np.float16):
+        self.path = path
+        self.feature_dim = feature_dim
+        self.dtype = np.dtype(dtype)
+        dtype_code = {np.dtype(v): k for k, v in DTYPES.items()}[self.dtype]
+        frame_h, frame_w = frame_shape[:2]
+        self.f = open(path, "wb")
+        self.f.write(
+            HEADER.pack(MAGIC, VERSION, feature_dim, dtype_code, frame_h, frame_w)
+        )
+        self.frames = 0
+        logger.info(f"record detections to {path}")
+
+    def write(self, frame_id, boxes, confidences, feature_vecs=None):
+        """
+        :param: frame_id: frame number
+        :param: boxes: (xmin, ymin, xmax, ymax) with the [N, 4] shape
+        :param: confidences: detection confidences with the [N] shape
+        :param: feature_vecs: feature vectors with the [M, feature_dim] shape (M <= N)
+        """
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        if feature_vecs is None:
+            feature_vecs = np.empty((0, self.feature_dim))
+        feature_vecs = np.asarray(feature_vecs, dtype=self.dtype).reshape(
+            -1, self.feature_dim
+        )
+        self.f.write(FRAME_HEADER.pack(int(frame_id), len(boxes), len(feature_vecs)))
+        self.f.write(boxes.tobytes())
+        self.f.write(confidences.tobytes())
+        self.f.write(feature_vecs.tobytes())
+        self.frames += 1
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+            logger.info(f"recorded {self.frames} frames to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DetectionReplayer:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, feature_dim, dtype_code, frame_h, frame_w = HEADER.unpack(
+                f.read(HEADER.size)
+            )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a detection record (version {VERSION})")
+        self.feature_dim = feature_dim
+        self.dtype = np.dtype(DTYPES[dtype_code])
+        self.frame_shape = (frame_h, frame_w, 3)
+
+    def __iter__(self):
+        """
+        :returns:
+                frame_id, boxes, confidences, feature_vecs (float32) of each frame
+        """
+        with open(self.path, "rb") as f:
+            f.seek(HEADER.size)
+            while True:
+                frame_header = f.read(FRAME_HEADER.size)
+                if len(frame_header) < FRAME_HEADER.size:
+                    return
+                frame_id, n_boxes, n_vecs = FRAME_HEADER.unpack(frame_header)
+                boxes = np.frombuffer(f.read(n_boxes * 16), dtype=np.int32)
+                confidences = np.frombuffer(f.read(n_boxes * 4), dtype=np.float32)
+                feature_vecs = np.frombuffer(
+                    f.read(n_vecs * self.feature_dim * self.dtype.itemsize),
+                    dtype=self.dtype,
+                )
+                yield (
+                    frame_id,
+                    boxes.reshape(n_boxes, 4).astype(int),
+                    confidences,
+                    feature_vecs.reshape(n_vecs, self.feature_dim).astype(np.float32),
+                )
@@ -0,0 +1,290 @@
+"""Rendering of the detection and tracking results
+
+Detections and Tracker return structured results only and do not draw into the
+frames. Renderer draws the results, so that rendering is an optional stage which is
+skipped in headless mode and run only once, on the display thread, in the app.
+"""
+import pickle as pkl
+import configparser
+
+import cv2
+import numpy as np
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+prob_thld_person = eval(config.get("DETECTION", "prob_thld_person"))
+show_track = eval(config.get("TRACKER", "show_track"))
+
+# basic colors
+green = eval(config.get("COLORS", "green"))
+skyblue = eval(config.get("COLORS", "skyblue"))
+
+
+class Renderer:
+    def __init__(self, show_track=show_track):
+        self.show_track = show_track
+        self.colors = pkl.load(open("pallete", "rb"))
+
+    def get_color(self, person_id: int) -> tuple:
+        # Difine person's color from Pallete (self.colors) with 100 colors.
+        # The 100th person_id will use the first index's color again.
+        color_id = person_id - len(self.colors) * \
+            (person_id // len(self.colors))
+        return self.colors[color_id]
+
+    def render(self, result):
+        """
+        Draw a result of Detections.person_detection into its frame
+
+        :param: result: dict of the frame and its detection and tracking results
+        :returns:
+                frame: the frame of the result (or its copy when it is read-only)
+                       with the results drawn
+        """
+        frame = result["frame"]
+        # frames shared by libs.frame_buffer.FrameBuffer are read-only
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        if result["is_det"]:
+            for det_id, (box, confidence) in enumerate(
+                zip(result["boxes"], result["confidences"])
+            ):
+                frame = self.draw_bbox(frame, box, f"{det_id} {confidence}%", green)
+        if result["track_info"] is not None:
+            frame = self.draw_track_info(frame, result["track_info"])
+        frame = self.draw_perf_stats(frame, result)
+        return frame
+
+    def draw_bbox(self, frame, box, result, color):
+        xmin, ymin, xmax, ymax = box
+        size = cv2.getTextSize(result, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
+        xtext = xmin + size[0][0] + 20
+        cv2.rectangle(
+            frame, (xmin, ymin - 22), (xtext, ymin), color, -1,
+        )
+        cv2.rectangle(
+            frame, (xmin, ymin - 22), (xtext, ymin), color,
+        )
+        cv2.rectangle(
+            frame, (xmin, ymin), (xmax, ymax), color, 1,
+        )
+        cv2.putText(
+            frame,
+            result,
+            (xmin + 3, ymin - 5),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            (0, 0, 0),
+            1,
+        )
+        return frame
+
+    def draw_perf_stats(self, frame, result):
+        # Draw FPS on top right corner
+        cv2.rectangle(
+            frame,
+            (frame.shape[1] - 50, 0),
+            (frame.shape[1], 17),
+            (255, 255, 255),
+            -1
+        )
+        cv2.putText(
+            frame,
+            result["fps"],
+            (frame.shape[1] - 50 + 3, 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.35,
+            (0, 0, 0),
+            1,
+        )
+        # Draw Real-Time Person Counter on top right corner
+        if result["person_counter"] is not None:
+            cv2.rectangle(
+                frame,
+                (frame.shape[1] - 50, 17),
+                (frame.shape[1], 34),
+                (255, 255, 255),
+                -1,
+            )
+            cv2.putText(
+                frame,
+                f"DET: {result['person_counter']}",
+                (frame.shape[1] - 50 + 3, 27),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.35,
+                (0, 0, 0),
+                1,
+            )
+
+        # Draw Frame number at bottom corner
+        cv2.rectangle(
+            frame,
+            (frame.shape[1] - 50, frame.shape[0] - 20),
+            (frame.shape[1], frame.shape[0]),
+            (255, 255, 255),
+            -1,
+        )
+        cv2.putText(
+            frame,
+            str(result["frame_id"]).zfill(5),
+            (frame.shape[1] - 40, frame.shape[0] - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.35,
+            (0, 0, 0),
+            1,
+        )
+
+        # Draw performance stats
+        mode = "async" if result["is_async"] else "sync"
+        inf_time_message = (
+            f"Total Inference time: {result['det_time'] * 1000:.3f} ms for {mode} mode"
+        )
+        cv2.putText(
+            frame,
+            inf_time_message,
+            (10, 15),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            (200, 10, 10),
+            1,
+        )
+        if result["det_time_txt"]:
+            inf_time_message = (
+                f"@Detection prob:{prob_thld_person} time: {result['det_time_txt']}"
+            )
+            cv2.putText(
+                frame,
+                inf_time_message,
+                (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.4,
+                (200, 10, 10),
+                1,
+            )
+        return frame
+
+    def draw_track_info(self, frame, track_info):
+        # Draw a result of Tracker.person_reidentification:
+        # occluded detections, confirmed tracks, counter area and tracker parameters
+        for det_id, box in track_info["occluded"]:
+            frame = self.draw_det_box(frame, det_id, box, color=skyblue)
+        for track in track_info["tracks"]:
+            frame = self.draw_track(frame, track)
+        if track_info["enable_count"]:
+            frame = self.draw_counter_stats(
+                frame, track_info["lines"], track_info["counter_stats"]
+            )
+        frame = self.draw_params(frame, track_info["params"])
+        return frame
+
+    def draw_counter_stats(self, frame, lines, counter_stats):
+        # Draw counting lines and their counters at their first points
+        for name, points in lines.items():
+            cv2.polylines(
+                frame, [np.array(points)], isClosed=False, color=skyblue, thickness=1,
+            )
+            counts = counter_stats[name]
+            x, y = points[0]
+            cv2.putText(
+                frame,
+                f"{name} in:{counts['in']} out:{counts['out']}",
+                (x + 3, y - 5),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (255, 255, 255),
+                1,
+            )
+        return frame
+
+    def draw_params(self, frame, params):
+        cv2.putText(
+            frame,
+            params,
+            (10, frame.shape[0] - 15),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            (200, 10, 10),
+            1,
+        )
+        return frame
+
+    def draw_det_box(self, frame, det_id, box, color=(0, 255, 0)):
+        xmin, ymin, xmax, ymax = box
+        cv2.putText(
+            frame,
+            str(det_id),
+            (xmax - 3, ymin - 5),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            color,
+            1,
+        )
+        cv2.rectangle(
+            frame, (xmin, ymin), (xmax, ymax), color, 1,
+        )
+        return frame
+
+    def draw_reid_box(self, frame, person_id, box, track_point, conf, color):
+        x, y = track_point
+        if np.isnan(x) or np.isnan(y):
+            return frame
+
+        cv2.putText(
+            frame,
+            str(person_id),
+            (int(x), int(y)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            color,
+            2,
+        )
+
+        xmin, ymin, xmax, ymax = map(int, box)
+        text = f"{person_id} {conf}"
+        size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
+
+        # adjust reid box shape
+        xtext = xmin + size[0][0] + 15
+        cv2.rectangle(frame, (xmin, ymin - 22), (xtext, ymin), color, -1)
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 1)
+        cv2.rectangle(frame, (xmin, ymin - 22), (xtext, ymin), color)
+        cv2.putText(
+            frame,
+            text,
+            (xmin + 3, ymin - 5),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            (255, 255, 255),
+            1,
+        )
+
+        return frame
+
+    def draw_track_points(self, frame, track_points, color):
+        # track_points: history of centers which may include nan (lost) points
+        track_points = track_points[~np.isnan(track_points).any(axis=1)].astype(int)
+        if len(track_points) > 2:
+            cv2.polylines(
+                frame, [track_points], isClosed=False, color=color, thickness=2,
+            )
+        return frame
+
+    def draw_track(self, frame, track):
+        # Get person's color for draw rectrangle and tracked points
+        color = self.get_color(track["id"])
+
+        # Set similarity as confidence
+        confidence = track["confidence"]
+        conf = f"{round(confidence * 100, 1)}%" if confidence else "lost.."
+
+        # Draw reid box at the last track point
+        track_points = track["track_points"]
+        frame = self.draw_reid_box(
+            frame, track["id"], track["bbox"], track_points[-1], conf, color
+        )
+
+        # Draw track porints
+        if self.show_track:
+            frame = self.draw_track_points(frame, track_points, color)
+        return frame
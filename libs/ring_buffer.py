@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class RingBuffer:
+    # Fixed-capacity history of rows (ex. track points) in a numpy array.
+    # Every row is written twice, at head and at head + capacity, so that the last
+    # k rows are always contiguous and returned as a view without copying.
+    # Appending and replacing the last row are O(1), and the oldest rows are
+    # overwritten when the buffer is full.
+    def __init__(self, capacity, width, dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, width), dtype=dtype)
+        self.head = 0  # index of the next row to write
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        return self.last()[idx]
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.data[self.head + self.capacity] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def replace_last(self, value):
+        if self.size == 0:
+            self.append(value)
+            return
+        idx = (self.head - 1) % self.capacity
+        self.data[idx] = value
+        self.data[idx + self.capacity] = value
+
+    def reset(self, value=None):
+        # Drop all rows, and keep only value if given
+        self.head = 0
+        self.size = 0
+        if value is not None:
+            self.append(value)
+
+    def last(self, k=None):
+        # view of the last k rows (all rows when k is None) from the oldest one
+        k = self.size if k is None else min(k, self.size)
+        end = self.head + self.capacity
+        return self.data[end - k: end]
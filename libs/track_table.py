@@ -0,0 +1,201 @@
+import numpy as np
+
+# track state
+TENTATIVE = 1
+CONFIRMED = 2
+DELETED = 3
+# lost for a long time and kept only to re-identify the person (hold_track)
+ARCHIVED = 4
+
+ACTIVE_STATES = (TENTATIVE, CONFIRMED)
+
+# initial value of each column
+COLUMN_FILLS = {
+    "status": 0,
+    "hits": 0,
+    "miss": 0,
+    "person_id": -1,  # the person_id has not been assigned yet
+    "is_matched": False,
+    "box": np.nan,
+    "center": np.nan,
+    "prev_center": np.nan,
+    "line_direction": -1,
+    "line_crossing": -1,
+    "line_cross_frame": -1,
+    "last_reid_frame": -1,
+    "euc_dist_count": 0,
+    "euc_dist_sum": 0.0,
+    "euc_dist_sumsq": 0.0,
+}
+
+
+class TrackTable:
+    # State of all tracks as a struct of arrays, one row per track_id.
+    # The capacity is doubled when it is full. The ids of the active tracks
+    # (tentative or confirmed) and the archived tracks are maintained when the status
+    # of a track changes, so that the tracker does not scan every track ever created
+    # on each frame.
+    def __init__(self, capacity=64, n_lines=0):
+        """
+        :param: capacity: the number of tracks to allocate first
+        :param: n_lines: the number of counting lines (libs.line_counter.LineCounter)
+        """
+        self.size = 0
+        self.status = np.full(capacity, COLUMN_FILLS["status"], dtype=np.int8)
+        self.hits = np.full(capacity, COLUMN_FILLS["hits"], dtype=np.int32)
+        self.miss = np.full(capacity, COLUMN_FILLS["miss"], dtype=np.int32)
+        self.person_id = np.full(capacity, COLUMN_FILLS["person_id"], dtype=np.int64)
+        self.is_matched = np.full(capacity, COLUMN_FILLS["is_matched"], dtype=bool)
+        # last (predicted or detected) box and center of the tracks
+        self.box = np.full((capacity, 4), COLUMN_FILLS["box"])
+        self.center = np.full((capacity, 2), COLUMN_FILLS["center"])
+        # center of the previous frame to count the crossings of the last movement
+        self.prev_center = np.full((capacity, 2), COLUMN_FILLS["prev_center"])
+        # per counting line: the last counted direction (index of DIRECTIONS), and the
+        # direction and frame_id of the last crossing whether counted or not (-1: none)
+        self.line_direction = np.full(
+            (capacity, n_lines), COLUMN_FILLS["line_direction"], dtype=np.int8
+        )
+        self.line_crossing = np.full(
+            (capacity, n_lines), COLUMN_FILLS["line_crossing"], dtype=np.int8
+        )
+        self.line_cross_frame = np.full(
+            (capacity, n_lines), COLUMN_FILLS["line_cross_frame"], dtype=np.int64
+        )
+        # the last frame_id when the feature vector was computed by re-identification
+        self.last_reid_frame = np.full(
+            capacity, COLUMN_FILLS["last_reid_frame"], dtype=np.int64
+        )
+        # running count, sum and sum of squares of the euclidean distances in the window
+        self.euc_dist_count = np.full(capacity, COLUMN_FILLS["euc_dist_count"], dtype=np.int32)
+        self.euc_dist_sum = np.full(capacity, COLUMN_FILLS["euc_dist_sum"])
+        self.euc_dist_sumsq = np.full(capacity, COLUMN_FILLS["euc_dist_sumsq"])
+        # active/archived track ids in the order they were set (dict as an ordered set)
+        self._active = {}
+        self._archived = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, track_id):
+        if not 0 <= track_id < self.size:
+            raise IndexError(f"track_id:{track_id} out of range")
+        return Track(self, track_id)
+
+    def __iter__(self):
+        return (Track(self, track_id) for track_id in range(self.size))
+
+    def _reserve(self, size):
+        capacity = len(self.status)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, fill in COLUMN_FILLS.items():
+            column = getattr(self, name)
+            new_column = np.full((capacity,) + column.shape[1:], fill, dtype=column.dtype)
+            new_column[: self.size] = column[: self.size]
+            setattr(self, name, new_column)
+
+    def add(self, box, center) -> int:
+        # Add a tentative track and return its track_id
+        self._reserve(self.size + 1)
+        track_id = self.size
+        self.size += 1
+        self.box[track_id] = box
+        self.center[track_id] = center
+        self.set_status(track_id, TENTATIVE)
+        return track_id
+
+    def set_status(self, track_id, status):
+        self.status[track_id] = status
+        if status in ACTIVE_STATES:
+            self._active[track_id] = None
+        else:
+            self._active.pop(track_id, None)
+        if status == ARCHIVED:
+            self._archived[track_id] = None
+        else:
+            self._archived.pop(track_id, None)
+
+    def active_ids(self) -> list:
+        return list(self._active)
+
+    def archived_ids(self) -> list:
+        return list(self._archived)
+
+    def update(self, track_id):
+        # count up when detected person was matched
+        self.hits[track_id] += 1
+        self.miss[track_id] = 0
+        self.is_matched[track_id] = True
+
+    def lost(self, track_id):
+        # count up when detected person was lost
+        self.hits[track_id] = 0
+        self.miss[track_id] += 1
+        self.is_matched[track_id] = False
+
+
+class Track:
+    # Based on:
+    # https://github.com/nwojke/deep_sort/blob/master/deep_sort/track.py
+    #
+    # View of a row of TrackTable
+    # hists : count up when detected person was matched
+    # miss  : count up when detected person was lost
+    # stats : 1: Tentative Confirmed = 2 Deleted = 3 Archived = 4
+    __slots__ = ("table", "track_id")
+
+    def __init__(self, table, track_id):
+        self.table = table
+        self.track_id = track_id
+
+    @property
+    def stats(self):
+        return int(self.table.status[self.track_id])
+
+    @stats.setter
+    def stats(self, status):
+        self.table.set_status(self.track_id, status)
+
+    @property
+    def hits(self):
+        return int(self.table.hits[self.track_id])
+
+    @property
+    def miss(self):
+        return int(self.table.miss[self.track_id])
+
+    @property
+    def person_id(self):
+        person_id = int(self.table.person_id[self.track_id])
+        return None if person_id < 0 else person_id
+
+    @person_id.setter
+    def person_id(self, person_id):
+        self.table.person_id[self.track_id] = -1 if person_id is None else person_id
+
+    @property
+    def is_matched(self):
+        return bool(self.table.is_matched[self.track_id])
+
+    @is_matched.setter
+    def is_matched(self, is_matched):
+        self.table.is_matched[self.track_id] = is_matched
+
+    def update(self):
+        self.table.update(self.track_id)
+
+    def lost(self):
+        self.table.lost(self.track_id)
+
+    def to_dict(self):
+        return {
+            "track_id": self.track_id,
+            "person_id": self.person_id,
+            "hits": self.hits,
+            "miss": self.miss,
+            "stats": self.stats,
+            "is_matched": self.is_matched,
+        }
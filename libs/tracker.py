@@ -1,20 +1,24 @@
-from logging import getLogger
+from logging import getLogger, DEBUG
 from time import sleep
-import cv2
 import numpy as np
-from munkres import Munkres
 from timeit import default_timer as timer
-from libs.utils import cos_similarity
-from libs.utils import get_iou, get_iou2
+from libs.utils import l2_normalize
+from libs.utils import get_iou, get_iou_matrix
 from libs.utils import get_euclidean_distance
 from libs.utils import get_mahalanobis_distance
 from libs.utils import affine_translation
 from libs.utils import get_box_coordinates
-import pickle as pkl
 import configparser
-from scipy import stats
 
-from libs.kalman_filter import KalmanFilter
+from libs.ann_index import IVFIndex
+from libs.assignment import get_assignment_solver
+from libs.gallery import FeatureGallery
+from libs.log_utils import EventLogger
+from libs.kalman_filter import BatchKalmanFilter
+from libs.line_counter import DIRECTIONS, LineCounter, grid_lines
+from libs.ring_buffer import RingBuffer
+from libs.track_table import TENTATIVE, CONFIRMED, DELETED, ARCHIVED
+from libs.track_table import TrackTable
 
 logger = getLogger(__name__)
 
@@ -31,77 +35,69 @@ save_points = eval(config.get("TRACKER", "save_points"))
 max_grid = eval(config.get("TRACKER", "max_grid"))
 lost_thld = eval(config.get("TRACKER", "lost_thld"))
 hold_track = eval(config.get("TRACKER", "hold_track"))
+archive_thld = eval(config.get("TRACKER", "archive_thld"))
+archive_n_probe = eval(config.get("TRACKER", "archive_n_probe"))
+reid_skip = eval(config.get("TRACKER", "reid_skip"))
+reid_skip_iou_thld = eval(config.get("TRACKER", "reid_skip_iou_thld"))
+reid_refresh_interval = eval(config.get("TRACKER", "reid_refresh_interval"))
+counting_lines = eval(config.get("TRACKER", "counting_lines"))
+count_settle_frames = eval(config.get("TRACKER", "count_settle_frames"))
+# The number of the last euclidean distances of a track to evaluate a detection
+euc_dist_window = 30
+# z-value of the 99% confidence interval of the normal distribution
+euc_dist_z = 2.5758293035489004
+
+# Emit one of every n tracker events of each kind
+event_sampling = eval(config.get("LOGGING", "event_sampling"))
 show_track = eval(config.get("TRACKER", "show_track"))
-
-# basic colors
-green = eval(config.get("COLORS", "green"))
-skyblue = eval(config.get("COLORS", "skyblue"))
-red = eval(config.get("COLORS", "red"))
-
-# track state
-TENTATIVE = 1
-CONFIRMED = 2
-DELETED = 3
+assignment_solver = config.get("TRACKER", "assignment_solver")
+reid_infer_mode = config.get("REIDENTIFICATION", "reid_infer_mode")
 
 
 class Person:
     pass
 
 
-class Track:
-    # Based on:
-    # https://github.com/nwojke/deep_sort/blob/master/deep_sort/track.py
-    #
-    # hists : count up when detected person was matched
-    # miss  : count up when detected person was lost
-    # stats : 1: Tentative Confirmed = 2 Deleted = 3
-    def __init__(self, track_id, center):
-        self.track_id = track_id
-        self.person_id = None
-        self.hits = 0
-        self.miss = 0
-        self.stats = TENTATIVE
-        self.kf = KalmanFilter(center)
-        self.is_matched = False
-        self.direction = None
-
-    def update(self):
-        self.hits += 1
-        self.miss = 0
-        self.is_matched = True
-
-    def lost(self):
-        self.hits = 0
-        self.miss += 1
-        self.is_matched = False
-
-
 class Tracker:
     def __init__(self, detector, frame, grid):
         # initialize tracker parameters
         self.person_id_detector = detector
         self.frame_id = 0
-        self.show_track = show_track
         self.frame_h, self.frame_w = frame.shape[:2]
         self.person_id = 0
         self.track_vecs = None
+        # ANN index of the feature vectors of the archived tracks (key: track_id)
+        self.archive = None
         self.track_boxes = []
-        self.prev_feature_vecs = None
-        self.prev_track_boxes = None
+        # feature vectors of the detected persons in the current frame
+        self.feature_vecs = None
+        # mask of the detections which reused the feature vectors of their tracks
+        self.reused = None
+        # confirmed tracks and occluded detections of the current frame to be rendered
+        self.visible_tracks = []
+        self.occluded = []
         self.track_points = []
-        self.track_points_measured = []
         self.euc_distances = []
-        self.tracks = []
+        # kalman filter states of all tracks, one row per track_id
+        self.kf = BatchKalmanFilter()
         self.tracker_prev_time = timer()
         self.tracker_accum_time = 0
-        self.counter_stats = {"top": 0, "bottom": 0, "left": 0, "right": 0}
-        self.colors = pkl.load(open("pallete", "rb"))
         self.params = f"@Track sim:{sim_thld} min_sim:{min_sim_thld} skip_iou:{skip_iou_thld} box_iou:{box_iou_thld} grid:{grid} lost:{lost_thld} hold_track:{hold_track} show_track:{show_track}"
         self.enable_count = None
         # set tracker boundary and counter ranage ing a frame
         self.grid, self.enable_count = self._set_grid(grid)
         self.track_range = self._set_track_range(frame, self.grid)
-        self.m = Munkres()
+        # count persons who cross the counting lines (the grid edges by default)
+        if counting_lines:
+            self.enable_count = True
+        self.line_counter = LineCounter(counting_lines or grid_lines(self.track_range))
+        # state of all tracks (struct of arrays) and its track views
+        self.tracks = TrackTable(n_lines=len(self.line_counter.names))
+        # disable the tracks which went out of the counter area (grid edges only)
+        self.disable_counted = not counting_lines
+        self.assign = get_assignment_solver(assignment_solver)
+        # structured tracker events (level checks and sampling before formatting)
+        self.events = EventLogger(logger, event_sampling)
 
     def _next_id(self):
         self.person_id += 1
@@ -141,23 +137,24 @@ class Tracker:
 
         return track_range
 
-    def kalman_filter(self, track_id, center: tuple, update: bool) -> tuple:
-
-        kf = self.tracks[track_id].kf
-        kf.predict()
-
-        # filtere the observated value when update
-        if update:
-            kf.update(center)
-
-        cx, cy, vx, vy = kf.X.flatten().astype(int)
-        center = cx, cy
-        velocity = vx, vy
+    def kalman_filter(self, track_ids: list, centers: list = None) -> list:
+        # Predict step for the tracks when centers is None, otherwise filter the
+        # observated centers of the tracks (update step).
+        # Return the center coordinates of the tracks.
+        if not len(track_ids):
+            return []
+        if centers is None:
+            X = self.kf.predict(track_ids)
+        else:
+            X = self.kf.update(track_ids, centers)
 
-        message = f"frame_id:{self.frame_id} track_id:{track_id} center:{center} velocity:{velocity}"
-        logger.debug(message)
+        X = X.astype(int).tolist()
+        if logger.isEnabledFor(DEBUG):
+            for track_id, (cx, cy, vx, vy) in zip(track_ids, X):
+                message = f"frame_id:{self.frame_id} track_id:{track_id} center:{(cx, cy)} velocity:{(vx, vy)}"
+                logger.debug(message)
 
-        return center, velocity
+        return [(cx, cy) for cx, cy, _, _ in X]
 
     def is_out_of_track_area(self, center: tuple) -> bool:
         top_left = self.track_range["top_left"]
@@ -175,24 +172,120 @@ class Tracker:
         return False
 
     def get_feature_vecs(self, person_frames):
-        feature_vecs = np.zeros((len(person_frames), 256))
-        for det_id, person_frame in enumerate(person_frames):
-            self.person_id_detector.infer(person_frame)
-            feature_vec = self.person_id_detector.get_results()
-            feature_vecs[det_id] = feature_vec
-        return feature_vecs
+        # (N, feature_dim) feature vectors with batched or asynchronous re-identification
+        if reid_infer_mode == "async":
+            return self.person_id_detector.infer_async(person_frames)
+        return self.person_id_detector.infer_batch(person_frames)
 
     def disable_tracking(self, track_id: int):
-        if hold_track:
+        # Keep confirmed tracks in the archive to re-identify the persons later
+        if hold_track and self.tracks[track_id].stats == CONFIRMED:
+            self.archive_track(track_id)
             return
 
-        self.track_vecs[track_id] = np.zeros((1, 256))
-        self.track_boxes[track_id] = [(np.nan, np.nan, np.nan, np.nan)]
-        self.track_points[track_id] = [(np.nan, np.nan)]
+        self.track_vecs[track_id] = 0
+        self.release_history(track_id)
+        self.tracks.box[track_id] = np.nan
+        self.tracks.center[track_id] = np.nan
         self.tracks[track_id].stats = DELETED
-        logger.debug(
-            f"frame_id:{self.frame_id} disabled person_id:{self.tracks[track_id].person_id}(track_id:{track_id}) {self.tracks[track_id].__dict__}"
+        if self.events.enabled("disabled", DEBUG):
+            self.events.emit(
+                "disabled", DEBUG, frame_id=self.frame_id, **self.tracks[track_id].to_dict()
+            )
+
+    def archive_track(self, track_id: int):
+        # Move the track from the active tracks (hot tier) to the archive (cold tier).
+        # Archived tracks are not matched on each frame, and are searched only when a
+        # detected person is about to be registered as a new person.
+        self.tracks[track_id].stats = ARCHIVED
+        self.archive.add(track_id, self.track_vecs[track_id])
+        self.release_history(track_id)
+        if self.events.enabled("archived", DEBUG):
+            self.events.emit(
+                "archived", DEBUG, frame_id=self.frame_id, **self.tracks[track_id].to_dict()
+            )
+
+    def create_history(self, track_id, box, center):
+        # Ring buffers of the last track points, boxes and euclidean distances of an
+        # active track (track_id is len(self.track_points) for a new track)
+        track_points = RingBuffer(save_points, 2)
+        track_points.append(center)
+        track_boxes = RingBuffer(save_points, 4)
+        track_boxes.append(box)
+        history = (
+            (self.track_points, track_points),
+            (self.track_boxes, track_boxes),
+            (self.euc_distances, RingBuffer(euc_dist_window, 1)),
         )
+        for buffers, buffer in history:
+            if track_id == len(buffers):
+                buffers.append(buffer)
+            else:
+                buffers[track_id] = buffer
+
+    def release_history(self, track_id):
+        # Archived (cold) and deleted tracks do not need their history. The archived
+        # person is kept only by the feature vector in the archive.
+        self.track_points[track_id] = None
+        self.track_boxes[track_id] = None
+        self.euc_distances[track_id] = None
+
+    def search_archive(self, feature_vec):
+        # Return the track_id of the archived person who has the highest similarity
+        # above sim_thld with the feature vector, or None
+        if self.archive is None or not len(self.archive):
+            return None
+        track_ids, similarities = self.archive.search(feature_vec, k=1)
+        if not len(track_ids) or similarities[0] <= sim_thld:
+            return None
+        return int(track_ids[0])
+
+    def revive_track(self, track_id: int, box, center, feature_vec):
+        # Restart the archived track with the detected person keeping its person_id
+        self.archive.remove(track_id)
+        self.track_vecs[track_id] = feature_vec
+        self.create_history(track_id, box, center)
+        self.tracks.euc_dist_count[track_id] = 0
+        self.tracks.euc_dist_sum[track_id] = 0.0
+        self.tracks.euc_dist_sumsq[track_id] = 0.0
+        self.tracks.box[track_id] = box
+        self.tracks.center[track_id] = center
+        self.tracks.prev_center[track_id] = np.nan
+        self.tracks.hits[track_id] = 0
+        self.tracks.miss[track_id] = 0
+        self.tracks.line_direction[track_id] = -1
+        self.tracks.line_crossing[track_id] = -1
+        self.tracks.line_cross_frame[track_id] = -1
+        self.tracks.last_reid_frame[track_id] = int(self.frame_id)
+        self.tracks[track_id].stats = CONFIRMED
+        self.kf.reset(track_id, center)
+        if self.events.enabled("revived"):
+            self.events.emit(
+                "revived",
+                frame_id=self.frame_id,
+                person_id=self.tracks[track_id].person_id,
+                track_id=track_id,
+            )
+
+    def assign_person_id(self, track_id: int) -> int:
+        # Return the person_id of the archived person who is identical with the newly
+        # confirmed track (the archived track is taken over by it), or a new person_id
+        archived_track_id = self.search_archive(self.track_vecs[track_id]) if hold_track else None
+        if archived_track_id is None:
+            return self._next_id()
+
+        self.archive.remove(archived_track_id)
+        self.tracks[archived_track_id].stats = DELETED
+        person_id = self.tracks[archived_track_id].person_id
+        if self.events.enabled("re-identified"):
+            self.events.emit(
+                "re-identified",
+                frame_id=self.frame_id,
+                person_id=person_id,
+                archived_track_id=archived_track_id,
+                track_id=track_id,
+            )
+        return person_id
 
     def register_person(self, det_id: int, detection):
 
@@ -201,222 +294,138 @@ class Tracker:
             return
 
         center = self.get_center(detection.box)
-        self.track_points.append([center])
-        self.track_points_measured.append([center])
-        self.track_vecs = np.vstack((self.track_vecs, detection.feature_vec))
-        self.track_boxes.append([detection.box])
-        self.euc_distances.append([0.0])
-
-        # Create track instance
-        track_id = len(self.tracks)
-        self.tracks.append(Track(track_id, center))
-
-        header = f"frame_id:{self.frame_id} registered det_id:{det_id} to track_id:{track_id} track:{self.tracks[track_id].__dict__}"
-        info1 = f"conf:{detection.confidence:.3f}"
-        logger.info(f"{header} {info1}")
-
-    def get_counter_stats(self, track_id: int, direction: str):
-        # Count the number of persons who have gone out of the counter area,
-        # based on the current position of the detected person and the direction in which
-        # they have moved.
-        # Set the name of the direction and the names of the four corners associated with
-        # the direction to be counted.
-        direction_x, direction_y = 0, 1
-        direction_corner_dict = {
-            "top": ("top_right", direction_y),
-            "bottom": ("bottom_right", direction_y),
-            "left": ("top_left", direction_x),
-            "right": ("top_right", direction_x),
-        }
-        # Get three coordinates of track points:
-        # Start   : center coordinate when person re-identification started
-        # End     : center coordinate when person re-identification ended
-        # boundary: counter boundary coordinate which "_set_track_range" defined
-        track_points = self.track_points[track_id]
-        start_tmp = track_points[0]
-        end_tmp = track_points[-1]
-        corner_name, count_direction = direction_corner_dict[direction]
-        boundary = self.track_range[corner_name][count_direction]
-        start = start_tmp[count_direction]
-        end = end_tmp[count_direction]
-
-        # Check direction and count up by the direction
-        out_of_track = False
-        track = self.tracks[track_id]
-        if direction in ["right", "bottom"]:
-            out_of_track = start <= boundary <= end
-            message = f"frame_id:{self.frame_id} {direction}: person_id:{track.person_id} ({start} <= {boundary} <= {end})"
-        if direction in ["top", "left"]:
-            out_of_track = start >= boundary >= end
-            message = f"frame_id:{self.frame_id} {direction}: person_id:{track.person_id} ({start} >= {boundary} >= {end})"
-
-        if out_of_track and track.direction != direction:
-            self.counter_stats[direction] += 1
-            track.direction = direction
-            logger.debug(message)
-            return out_of_track
-        return out_of_track
-
-    def count_person(self, track_id):
-        track_points = self.track_points[track_id]
-        if track_points is None or len(track_points) < 3:
-            return
+        track_id = self.add_track(detection.box, center, detection.feature_vec)
+
+        if self.events.enabled("registered"):
+            self.events.emit(
+                "registered",
+                frame_id=self.frame_id,
+                det_id=det_id,
+                conf=detection.confidence,
+                **self.tracks[track_id].to_dict(),
+            )
 
-        for direction in ["top", "bottom", "left", "right"]:
-            if self.get_counter_stats(track_id, direction):
-                self.disable_tracking(track_id)
+    def get_visible_track(self, track_id, box, confidence=None) -> dict:
+        # Information of a confirmed track to be rendered (confidence is None when lost)
+        return {
+            "track_id": track_id,
+            "id": self.tracks[track_id].person_id,
+            "bbox": box,
+            "confidence": confidence,
+            "track_points": self.track_points[track_id].last().copy(),
+        }
 
-    def draw_counter_stats(self, frame):
+    def add_visible_track(self, track_id, box, confidence=None):
+        # Keep the information of the confirmed track to be rendered
+        if self.tracks[track_id].stats == CONFIRMED:
+            self.visible_tracks.append(self.get_visible_track(track_id, box, confidence))
+
+    def count_tracks(self):
+        # Test the last movements (previous center -> center) of all confirmed tracks
+        # matched in this frame against the counting lines at once and count the
+        # crossings. The center of a lost track is only predicted, so it is not counted.
+        # A crossing is counted when its direction differs from the last counted one of
+        # the track and the line, and the track did not cross the line in the last
+        # count_settle_frames frames before it. Otherwise it is counted when the track
+        # has not crossed the line again for count_settle_frames frames, so that a
+        # person who stands on a line is not counted each time the box jitters across it.
         if not self.enable_count:
-            return frame
-
-        # Get each corner's coordinate
-        top_left = self.track_range["top_left"]
-        top_right = self.track_range["top_right"]
-        bottom_left = self.track_range["bottom_left"]
-        bottom_right = self.track_range["bottom_right"]
-        # Draw countable area
-        cv2.line(frame, top_left, top_right, skyblue, 1)
-        cv2.line(frame, top_left, bottom_left, skyblue, 1)
-        cv2.line(frame, bottom_left, bottom_right, skyblue, 1)
-        cv2.line(frame, bottom_right, top_right, skyblue, 1)
-        # Draw counter stats
-        counter_info = ""
-        for direction in ["right", "bottom", "left", "top"]:
-            counter_info = (
-                f"{direction}:{self.counter_stats[direction]} " + counter_info
-            )
-        cv2.putText(
-            frame,
-            counter_info,
-            (20, frame.shape[0] - 30),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.75,
-            (255, 255, 255),
-            2,
-        )
-        return frame
-
-    def draw_params(self, frame):
-        cv2.putText(
-            frame,
-            self.params,
-            (10, frame.shape[0] - 15),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            (200, 10, 10),
-            1,
-        )
-        return frame
+            return
+        track_ids = np.array(self.tracks.active_ids(), dtype=int)
+        track_ids = track_ids[
+            (self.tracks.status[track_ids] == CONFIRMED) & self.tracks.is_matched[track_ids]
+        ]
+        if not len(track_ids):
+            return
+        frame_id = int(self.frame_id)
 
-    def draw_det_box(self, frame, det_id, box, color=(0, 255, 0)):
-        xmin, ymin, xmax, ymax = box
-        cv2.putText(
-            frame,
-            str(det_id),
-            (xmax - 3, ymin - 5),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            color,
-            1,
+        # 1. Crossings of this frame
+        idx, line_ids, directions = self.line_counter.crossings(
+            self.tracks.prev_center[track_ids], self.tracks.center[track_ids]
         )
-        cv2.rectangle(
-            frame, (xmin, ymin), (xmax, ymax), color, 1,
-        )
-        return frame
-
-    def draw_reid_box(self, frame, track_id, box, conf, color):
-
-        track = self.tracks[track_id]
-
-        x = self.track_points[track_id][-1][0]
-        y = self.track_points[track_id][-1][1]
-        if np.isnan(x) or np.isnan(y):
-            return frame
-
-        cv2.putText(
-            frame,
-            str(track.person_id),
-            (int(x), int(y)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.6,
-            color,
-            2,
+        rows = track_ids[idx]
+        prev_frames = self.tracks.line_cross_frame[rows, line_ids]
+        is_settled = (prev_frames < 0) | (frame_id - prev_frames >= count_settle_frames)
+        self.tracks.line_crossing[rows, line_ids] = directions
+        self.tracks.line_cross_frame[rows, line_ids] = frame_id
+
+        # 2. Crossings to be counted: the settled crossings of this frame and the last
+        # crossings which have been settled since then
+        is_new = np.zeros((len(track_ids), len(self.line_counter.names)), dtype=bool)
+        is_new[idx[is_settled], line_ids[is_settled]] = True
+        crossing = self.tracks.line_crossing[track_ids]
+        is_settled = frame_id - self.tracks.line_cross_frame[track_ids] >= count_settle_frames
+        to_count = (
+            (crossing >= 0)
+            & (crossing != self.tracks.line_direction[track_ids])
+            & (is_new | is_settled)
         )
+        idx, line_ids = np.nonzero(to_count)
+        if not len(idx):
+            return
+        directions = crossing[idx, line_ids]
+        self.tracks.line_direction[track_ids[idx], line_ids] = directions
+        self.line_counter.add(line_ids, directions)
 
-        # if box is None:
-        #    return frame
+        for i, line_id, direction in zip(idx.tolist(), line_ids.tolist(), directions.tolist()):
+            track_id = int(track_ids[i])
+            track = self.tracks[track_id]
+            direction = f"{self.line_counter.names[line_id]}:{DIRECTIONS[direction]}"
+            if self.events.enabled("counted", DEBUG):
+                self.events.emit(
+                    "counted",
+                    DEBUG,
+                    frame_id=self.frame_id,
+                    direction=direction,
+                    person_id=track.person_id,
+                    track_id=track_id,
+                )
+            # The person who went out of the counter area (grid edges) is not tracked
+            if self.disable_counted and direction.endswith(":out") and track.stats == CONFIRMED:
+                self.disable_tracking(track_id)
 
-        xmin, ymin, xmax, ymax = box
-        text = f"{track.person_id} {conf}"
-        size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
-
-        # adjust reid box shape
-        xtext = xmin + size[0][0] + 15
-        cv2.rectangle(frame, (xmin, ymin - 22), (xtext, ymin), color, -1)
-        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 1)
-        cv2.rectangle(frame, (xmin, ymin - 22), (xtext, ymin), color)
-        cv2.putText(
-            frame,
-            text,
-            (xmin + 3, ymin - 5),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            (255, 255, 255),
-            1,
-        )
+    def get_track_info(self) -> dict:
+        # Tracking results of the frame other than person_info, to be rendered
+        return {
+            "tracks": self.visible_tracks,
+            "occluded": self.occluded,
+            "enable_count": self.enable_count,
+            "lines": self.line_counter.lines,
+            "counter_stats": self.line_counter.get_counts(),
+            "params": self.params,
+        }
 
-        return frame
+    def first_detection(self, feature_vecs):
 
-    def draw_track_points(self, frame, track_points, color):
-        if self.show_track:
-            track_points = np.array(track_points)
-            cv2.polylines(
-                frame, [track_points], isClosed=False, color=color, thickness=2,
-            )
-        return frame
+        # gallery of L2-normalized feature vectors, one row per track_id.
+        # The tracks of the first persons are added by person_reidentification
+        # as there are no active tracks yet.
+        self.track_vecs = FeatureGallery(feature_vecs.shape[1])
+        self.archive = IVFIndex(feature_vecs.shape[1], n_probe=archive_n_probe)
 
-    def draw_track_info(self, frame, track_id, box=None, confidence=None):
-        # Draw traking info only when track states is confirmed
-        track = self.tracks[track_id]
-        if track.stats != CONFIRMED:
-            return frame
-
-        # Get person's color for draw rectrangle and tracked points
-        color = self.get_color(track.person_id)
-
-        # Set similarity as confidence
-        conf = f"{round(confidence * 100, 1)}%" if confidence else "lost.."
-
-        # Draw reid box
-        frame = self.draw_reid_box(frame, track_id, box, conf, color)
-
-        # Draw track porints
-        tp = np.array(self.track_points[track_id])
-        track_points = tp[~np.isnan(tp).any(axis=1)].astype(int)
-        if len(track_points) > 2:
-            frame = self.draw_track_points(frame, track_points, color)
-
-        # Count a person by the direction when the person is out of counter area
-        if track_points.any():
-            if self.enable_count and self.is_out_of_track_area(track_points[-1]):
-                self.count_person(track_id)
-        return frame
-
-    def first_detection(self, feature_vecs, boxes):
-
-        self.track_vecs = feature_vecs
-        self.prev_feature_vecs = feature_vecs
-        self.prev_track_boxes = boxes
-        for box in boxes:
-            self.track_boxes.append([box])
-            center = self.get_center(box)
-            self.track_points.append([center])
-            self.track_points_measured.append([center])
-            self.euc_distances.append([0.0])
-            # Create track instance
-            track_id = len(self.tracks)
-            self.tracks.append(Track(track_id, center))
+    def add_track(self, box, center, feature_vec) -> int:
+        # Create a tentative track of a detected person and return its track_id.
+        # Track history is kept in ring buffers of the last save_points values.
+        # When hold_track, the person may be an archived one who comes back.
+        if hold_track:
+            track_id = self.search_archive(feature_vec)
+            if track_id is not None:
+                self.revive_track(track_id, box, center, feature_vec)
+                return track_id
+
+        self.create_history(len(self.track_points), box, center)
+        self.track_vecs.append(feature_vec)
+        track_id = self.tracks.add(box, center)
+        self.tracks.last_reid_frame[track_id] = int(self.frame_id)
+        self.kf.add(center)
+        return track_id
+
+    def add_tracks(self, det_ids, boxes, feature_vecs):
+        # Create tracks of the detected persons inside the tracking area
+        for det_id in det_ids:
+            box, center, feature_vec = self.get_box_info(det_id, boxes, feature_vecs)
+            if not self.is_out_of_track_area(center):
+                self.add_track(box, center, feature_vec)
 
     def get_center(self, box: tuple) -> tuple:
         # cy, cy : center coordinate of a person
@@ -425,21 +434,14 @@ class Tracker:
         cy = (ymax - ymin) / 2 + ymin
         return cx, cy
 
-    def get_color(self, person_id: int) -> tuple:
-        # Difine person's color from Pallete (self.colors) with 100 colors.
-        # The 100th person_id will use the first index's color again.
-        color_id = person_id - len(self.colors) * \
-            (person_id // len(self.colors))
-        return self.colors[color_id]
-
     def get_box_info(self, det_id: int, boxes, feature_vecs) -> tuple:
-        box = boxes[det_id]
+        box = tuple(boxes[det_id].tolist())
         center = self.get_center(box)
-        feature_vec = feature_vecs[det_id].reshape(1, 256)
+        feature_vec = feature_vecs[det_id].reshape(1, self.track_vecs.feature_dim)
         return box, center, feature_vec
 
     def get_box_iou(self, box: tuple, reid_box: tuple) -> float:
-        if np.nan in reid_box:
+        if np.isnan(reid_box).any():
             return 0.0
         det_box = affine_translation(box)
         reid_box = affine_translation(reid_box)
@@ -455,7 +457,7 @@ class Tracker:
 
         # 3. Get distance between dettected box and track box
         # and check if thease boxes are at the closest to location in last track points.
-        track_point = np.array(self.track_points[track_id][-1]).reshape(-1, 2)
+        track_point = self.track_points[track_id][-1].reshape(-1, 2)
         euc_dist = get_euclidean_distance(center, track_point).item(0)
 
         # 5. Get box iou between detected box and track box
@@ -473,65 +475,69 @@ class Tracker:
         detection.center = center
         detection.euc_dist = euc_dist
         detection.box_iou = box_iou
+        detection.is_reused = bool(self.reused[det_id])
 
         return detection
 
-    def is_overlapped(self, box, boxes):
-        # Check if the bounding box (bbox) overlaps with others.
+    def get_overlapped(self, boxes):
+        # Check if each bounding box (bbox) overlaps with the others at once.
         # If IoU is greater than iou_thld, it is in a state of overlap with others.
-        for box_ in boxes:
-            box_iou = get_iou(box, box_)
-            if box_iou > skip_iou_thld:
-                return True
+        box_iou_matrix = get_iou_matrix(boxes, boxes)
+        np.fill_diagonal(box_iou_matrix, 0)
+        return (box_iou_matrix > skip_iou_thld).any(axis=1)
+
+    def solve_occlusion_problem(self, det_id, detection, is_overlapped):
+        # If a detected box is overlapped with the other boxes, skip it and keep it as
+        # an occluded detection (rendered as a skyblue box).
+        if is_overlapped:
+            self.occluded.append((det_id, detection.box))
+            return True
         return False
 
-    def solve_occlusion_problem(self, frame, det_id, detection, boxes):
-        # If a detected box is overlapped with the other boxes, draw skyblue box over them.
-        del boxes[det_id]
-        if self.is_overlapped(detection.box, boxes):
-            # Draw skyblue ractangle over the detected person
-            frame = self.draw_det_box(
-                frame, det_id, detection.box, color=(255, 255, 0))
-            return frame, True
-        else:
-            # Draw green ractangle over the detected person
-            # frame = self.draw_det_box(frame, det_id, detection.box, color=(0, 255, 0))
-            return frame, False
-
-    def evaluate_euc_distance(self, detection, n=2):
-        # Exclude initial value
-        euc_distances = self.euc_distances[detection.track_id][1:]
-        # Get last 30 data
-        n = len(euc_distances) - 30
-        euc_distances = np.array(euc_distances[n:])
-
-        if euc_distances.size > 3:
-            mean = euc_distances.mean()
-            std = stats.tstd(euc_distances)
-            # min, max = stats.norm.interval(alpha=0.95, loc=mean, scale=std)
-            min, max = stats.norm.interval(confidence=0.99, loc=mean, scale=std)
-        else:
-            mean, std = 0.0, 0.0
-            min, max = 0.0, detection.box_w
-
+    def add_euc_distance(self, track_id, euc_dist):
+        # Append the distance to the window of the track, and update the running sum and
+        # sum of squares in O(1) with the distance which goes out of the window
+        euc_distances = self.euc_distances[track_id]
+        if len(euc_distances) == euc_distances.capacity:
+            old = euc_distances[0][0]
+            self.tracks.euc_dist_count[track_id] -= 1
+            self.tracks.euc_dist_sum[track_id] -= old
+            self.tracks.euc_dist_sumsq[track_id] -= old * old
+        euc_distances.append(euc_dist)
+        self.tracks.euc_dist_count[track_id] += 1
+        self.tracks.euc_dist_sum[track_id] += euc_dist
+        self.tracks.euc_dist_sumsq[track_id] += euc_dist * euc_dist
+
+    def get_euc_distance_stats(self, track_ids, box_ws):
+        # Mean, standard deviation and 99% confidence interval (min, max) of the
+        # euclidean distances in the window of the tracks with the [N, 4] shape.
+        # When a track has 3 or less distances, (0, 0, 0, box_w) is given.
+        count = self.tracks.euc_dist_count[track_ids]
+        total = self.tracks.euc_dist_sum[track_ids]
+        total_sq = self.tracks.euc_dist_sumsq[track_ids]
+        is_valid = count > 3
+        n = np.maximum(count, 2)
+        mean = total / n
+        # unbiased variance (same as scipy.stats.tstd)
+        std = np.sqrt(np.maximum(total_sq - total * mean, 0.0) / (n - 1))
+        stats = np.zeros((len(track_ids), 4))
+        stats[:, 0] = np.where(is_valid, mean, 0.0)
+        stats[:, 1] = np.where(is_valid, std, 0.0)
+        stats[:, 2] = np.where(is_valid, mean - euc_dist_z * std, 0.0)
+        stats[:, 3] = np.where(is_valid, mean + euc_dist_z * std, box_ws)
+        return stats
+
+    def evaluate_euc_distance(self, detection):
         # Memo: After all, if the Euclidean distance is smaller than the width of the bbox,
         # the distance is considered valid.
         # (Because the 95% confidence interval is not accurate enough for matching.)
         # is_valid_dist = 0 < detection.euc_dist < max
         is_valid_dist = detection.euc_dist < detection.box_w
-
-        detection.euc_dist_min = min
-        detection.euc_dist_max = max
-        detection.euc_dist_mean = mean
-        detection.euc_dist_std = std
-
         return is_valid_dist
 
     def evaluate_mah_distance(self, detection):
-        track_points = self.track_points[detection.track_id].copy()
         # Get last 30 points
-        n = len(track_points) - 30
-        track_points = np.array(track_points)[n:]
+        track_points = self.track_points[detection.track_id].last(30)
 
         if track_points.size > 3:
             mah_dist = get_mahalanobis_distance(detection.center, track_points)
@@ -567,61 +573,64 @@ class Tracker:
         )
         return update
 
-    def update(self, frame, detection):
+    def update(self, detection, center):
+        # center: the center of the detected person filtered by kalman filter
         track_id = detection.track_id
         track = self.tracks[track_id]
 
         # 1. Update feature vector
         self.track_vecs[track_id] = detection.feature_vec
+        if not detection.is_reused:
+            self.tracks.last_reid_frame[track_id] = int(self.frame_id)
 
         # 2. Update bouding box
         # *Replace* predicted box added in preprocess with detected person box
-        self.track_boxes[track_id].pop(-1)
-        self.track_boxes[track_id].append(detection.box)
-
-        # 3. Apply kalmanfilter and update a track point
-        center = detection.center
+        self.track_boxes[track_id].replace_last(detection.box)
+        self.tracks.box[track_id] = detection.box
 
+        # 3. Update a track point
         # *Replace* predicted center added in preprocess with filtered person center
-        self.track_points[track_id].pop(-1)
-        center, _ = self.kalman_filter(track_id, center, update=True)
-        self.track_points[track_id].append(center)
+        self.track_points[track_id].replace_last(center)
+        self.tracks.center[track_id] = center
+        # The previous center of a track which was lost until the last frame is a
+        # predicted point, so the movement of this frame is not counted
+        if track.miss:
+            self.tracks.prev_center[track_id] = center
 
         # 4. Assign new person_id to the track with three consecutive matches and set its status to CONFIRMED
         track.update()
         # If the track matched three times in a row, the status is set to CONFIRMED.
         if track.stats == TENTATIVE and track.hits > 3:
             track.stats = CONFIRMED
-            track.person_id = self._next_id()
+            track.person_id = self.assign_person_id(track_id)
 
         # 5. Add euclidean distance which is used evaluate()
-        self.euc_distances[track_id].append(detection.euc_dist)
+        self.add_euc_distance(track_id, detection.euc_dist)
 
-        # 6. Draw tracked information into the frame
-        frame = self.draw_track_info(
-            frame, track_id, detection.box, detection.confidence
-        )
+        # 6. Keep tracked information to be rendered
+        self.add_visible_track(track_id, detection.box, detection.confidence)
 
         # 7. Return person information
         confidence = round(detection.confidence * 100, 1)
-        track_points = self.track_points[track_id]
+        track_points = self.track_points[track_id].last().copy()
         person_info = {
             "id": track.person_id,
             "bbox": detection.box,
             "embedding": detection.feature_vec,
             "frame": self.frame_id,
+            "frame_id": self.frame_id,
             "confidence": confidence,
             "track_points": track_points
         }
 
-        return frame, person_info
+        return person_info
 
     def not_found(self, det_id, detection):
 
         # not register persons if they are out of tracking area
         if self.is_out_of_track_area(detection.center):
-            message = f"frame_id:{self.frame_id} det_id:{det_id} out of couter area"
-            logger.debug(message)
+            if self.events.enabled("out_of_area", DEBUG):
+                self.events.emit("out_of_area", DEBUG, frame_id=self.frame_id, det_id=det_id)
             return
 
         # if track exists (before a person is registered)
@@ -631,169 +640,234 @@ class Tracker:
         # Register as a new person
         # if box_iou between detected box and reid box is lower than box_iou_thld
         if not detection.is_valid_iou:
-            message = f"frame_id:{self.frame_id} det_id:{det_id} track_id:{detection.track_id} box_iou:{detection.box_iou}"
-            logger.debug(message)
+            if self.events.enabled("invalid_iou", DEBUG):
+                self.events.emit(
+                    "invalid_iou",
+                    DEBUG,
+                    frame_id=self.frame_id,
+                    det_id=det_id,
+                    track_id=detection.track_id,
+                    box_iou=detection.box_iou,
+                )
             self.register_person(det_id, detection)
 
-    def lost(self, frame, track):
-        # 1. Disable tracking when lost counter exceeded lost thld
+    def lost(self, track):
+        # 1. Disable tracking (or archive the track when hold_track) when lost counter
+        # exceeded the threshold
         track_id = track.track_id
-        if track.miss > lost_thld:
+        if track.miss > (archive_thld if hold_track else lost_thld):
             self.disable_tracking(track_id)
-            return frame
+            return
 
         # 2. Count up lost counter (track.miss +1)
         track.lost()
 
-        # 3. draw tracking information into the frame excluding tentative track
+        # 3. Keep tracking information of the predicted box excluding tentative track
         if track.stats == CONFIRMED:
-            pred_box = self.track_boxes[track.track_id][-1]
-            frame = self.draw_track_info(
-                frame, track_id, box=pred_box, confidence=None)
-
-        return frame
+            pred_box = tuple(self.track_boxes[track_id][-1].tolist())
+            self.add_visible_track(track_id, pred_box)
 
     def preprocess(self):
         # Initialize active track idx
-        active_track_ids = [
-            t.track_id for t in self.tracks if t.stats != DELETED]
+        active_track_ids = self.tracks.active_ids()
+        if not active_track_ids:
+            return active_track_ids
 
-        for track_id in active_track_ids:
-            track = self.tracks[track_id]
-            # initialize matched state which is used for "lost_track_ids"
-            track.is_matched = False
+        # initialize matched state which is used for "lost_track_ids"
+        self.tracks.is_matched[active_track_ids] = False
 
-            # predict step with kalman filter and get center coodinate
-            center, _ = self.kalman_filter(track_id, None, update=False)
-            self.track_points[track_id].append(center)
+        # predict step with kalman filter of all active tracks and get center coodinates
+        centers = self.kalman_filter(active_track_ids)
 
-            # Predict box from previous person boxes
-            prev_box = self.track_boxes[track_id][-1]
-            box = get_box_coordinates(prev_box, center)
-            box = np.array(box, dtype=int)
-            self.track_boxes[track_id].append(tuple(box))
+        # Predict boxes from previous person boxes
+        boxes = get_box_coordinates(self.tracks.box[active_track_ids].T, np.array(centers).T)
+        boxes = np.array(boxes).T.astype(int)
+        self.tracks.box[active_track_ids] = boxes
+        self.tracks.prev_center[active_track_ids] = self.tracks.center[active_track_ids]
+        self.tracks.center[active_track_ids] = centers
+
+        for track_id, center, box in zip(active_track_ids, centers, boxes):
+            self.track_points[track_id].append(center)
+            self.track_boxes[track_id].append(box)
 
             # Disable the track when the center predicted by kalmanfilter is out of frame
             if self.is_out_of_frame(center):
-                message = f"frame_id:{self.frame_id} person_id:{track.person_id}(track_id:{track.track_id}) is out of frame"
-                logger.debug(message)
-                self.disable_tracking(track.track_id)
-                continue
-
-            # 3. Slice track points and boxes  when the number of them exceeds save_points
-            track_points = self.track_points[track_id]
-            if len(track_points) > save_points:
-                n = len(track_points) - save_points
-                self.track_points[track_id] = track_points[n:]
-
-            track_boxes = self.track_boxes[track_id]
-            if len(track_boxes) > save_points:
-                n = len(track_boxes) - save_points
-                self.track_boxes[track_id] = track_boxes[n:]
+                if self.events.enabled("out_of_frame", DEBUG):
+                    self.events.emit(
+                        "out_of_frame",
+                        DEBUG,
+                        frame_id=self.frame_id,
+                        person_id=self.tracks[track_id].person_id,
+                        track_id=track_id,
+                    )
+                self.disable_tracking(track_id)
 
         # Get active track idx again to remove "DELETE" track in "is_out_out_frame" check
-        active_track_ids = [
-            t.track_id for t in self.tracks if t.stats != DELETED]
-
-        return active_track_ids
+        return self.tracks.active_ids()
+
+    def select_confident_detections(self, boxes, active_track_ids):
+        # Select the detections which can be associated with confirmed tracks by motion
+        # and IoU alone (reid_skip). A detection is confident when:
+        # - its IoU with the box predicted by kalman filter is greater than reid_skip_iou_thld
+        # - it overlaps only one track and the track overlaps only this detection
+        # - it does not overlap the other detections
+        # - the feature vector of the track was computed within reid_refresh_interval frames
+        # Return the track_ids whose feature vectors the detections reuse (-1: not confident)
+        reuse_track_ids = np.full(len(boxes), -1)
+        if not reid_skip or self.track_vecs is None or not active_track_ids:
+            return reuse_track_ids
+
+        active_track_ids = np.array(active_track_ids)
+        box_iou_matrix = get_iou_matrix(boxes, self.tracks.box[active_track_ids])
+        best = box_iou_matrix.argmax(axis=1)
+        best_iou = box_iou_matrix[np.arange(len(boxes)), best]
+        overlap = box_iou_matrix > skip_iou_thld
+        is_unique = (overlap.sum(axis=1) == 1) & (overlap.sum(axis=0)[best] == 1)
+        best_track_ids = active_track_ids[best]
+        is_confirmed = self.tracks.status[best_track_ids] == CONFIRMED
+        is_fresh = (
+            int(self.frame_id) - self.tracks.last_reid_frame[best_track_ids]
+            < reid_refresh_interval
+        )
+        confident = (
+            (best_iou > reid_skip_iou_thld)
+            & is_unique
+            & is_confirmed
+            & is_fresh
+            & ~self.get_overlapped(boxes)
+        )
+        reuse_track_ids[confident] = best_track_ids[confident]
+        return reuse_track_ids
 
-    def person_reidentification(self, frame, person_frames, boxes):
+    def person_reidentification(self, person_frames, boxes, feature_vecs=None):
+        # feature_vecs: feature vectors of the boxes computed beforehand (ex. replay).
+        # person_frames are not used when feature_vecs is given.
+        # Return person_info of the matched tracks and track_info (see get_track_info)
+        # which Renderer draws. Nothing is drawn here.
+        self.visible_tracks = []
+        self.occluded = []
 
         active_track_ids = self.preprocess()
+        self.feature_vecs = None
+        # feature vectors are computed up to reid_limit persons
+        boxes = boxes[:reid_limit]
 
-        # If no person and no active track, return frame.
-        # If no person is present but there are no active tracks, lost() should be done.
-        if not person_frames and not active_track_ids:
-            frame = self.draw_params(frame)
-            frame = self.draw_counter_stats(frame)
-            return frame, []
+        # If no person and no active track, return no person.
+        # If no person is present but there are active tracks, lost() should be done.
+        if len(boxes) == 0 and not active_track_ids:
+            return [], self.get_track_info()
 
-        if not person_frames and active_track_ids:
+        if len(boxes) == 0 and active_track_ids:
             for track_id in active_track_ids:
                 track = self.tracks[track_id]
-                frame = self.lost(frame, track)
-            return frame, []
+                self.lost(track)
+            self.count_tracks()
+            return [], self.get_track_info()
+
+        # Confident detections reuse the feature vectors of their tracks and
+        # re-identification runs only for the others
+        reuse_track_ids = self.select_confident_detections(boxes, active_track_ids)
+        self.reused = reuse_track_ids >= 0
+        reid_det_ids = np.flatnonzero(~self.reused)
+        if feature_vecs is None:
+            person_frames = [person_frames[det_id] for det_id in reid_det_ids]
+            feature_vecs = self.get_feature_vecs(person_frames) if person_frames else None
+        elif self.reused.any():
+            feature_vecs = feature_vecs[reid_det_ids]
+
+        # Normalize once here: the gallery keeps unit vectors written by update() and
+        # register_person(), so the cosine similarity is a single matrix product.
+        if self.reused.any():
+            reused_vecs = self.track_vecs[reuse_track_ids[self.reused]]
+            vecs = np.empty((len(boxes), reused_vecs.shape[1]), dtype=np.float32)
+            vecs[self.reused] = reused_vecs
+            if len(reid_det_ids):
+                vecs[reid_det_ids] = l2_normalize(feature_vecs)
+            feature_vecs = vecs
+            if self.events.enabled("reused", DEBUG):
+                self.events.emit(
+                    "reused",
+                    DEBUG,
+                    frame_id=self.frame_id,
+                    reused=int(self.reused.sum()),
+                    detections=len(boxes),
+                )
+        else:
+            feature_vecs = l2_normalize(feature_vecs)
+        self.feature_vecs = feature_vecs
 
         # The first feature vectors registration
-        feature_vecs = self.get_feature_vecs(person_frames[:reid_limit])
         if self.track_vecs is None:
-            self.first_detection(feature_vecs, boxes)
+            self.first_detection(feature_vecs)
 
-        # Register detected person and return the frame when there are no active tracks.
+        # Register detected persons and return when there are no active tracks.
         if not active_track_ids:
-            for det_id in range(len(boxes)):
-                box, center, feature_vec = self.get_box_info(
-                    det_id, boxes, feature_vecs
-                )
-                if not self.is_out_of_track_area(center):
-                    self.track_points.append([center])
-                    self.track_points_measured.append([center])
-                    self.track_vecs = np.vstack((self.track_vecs, feature_vec))
-                    self.track_boxes.append([box])
-                    self.euc_distances.append([0.0])
-                    track_id = len(self.tracks)
-                    self.tracks.append(Track(track_id, center))
-            return frame, []
+            self.add_tracks(range(len(boxes)), boxes, feature_vecs)
+            return [], self.get_track_info()
 
         # ----------- Preprocess -------------------- #
-        frame_id = f"frame_id:{self.frame_id}"
-
         # Cost Matrix
         # Compare the cosine similarity between the detected person's feature vectors and
-        # the retained feature vectors
-        similarities = cos_similarity(
-            feature_vecs, self.track_vecs[active_track_ids])
-        similarities[np.isnan(similarities)] = 0
-        if similarities.size < 1:
-            similarities = np.zeros((len(feature_vecs), len(self.track_vecs)))
+        # the retained feature vectors (both are unit vectors)
+        similarities = feature_vecs @ self.track_vecs[active_track_ids].T
         # Get the min cost(distance) from cos similarity
         cost_matrix = 1 - similarities
 
         # Box IoU Matrix
         # To account for uncertainty in the shape of bounding boxes, halve the cost of
         # IOU and add it to the cost matrix.
-        track_boxes = np.array(self.track_boxes, dtype=object)[
-            active_track_ids]
-        track_boxes = np.array([box[-1] for box in track_boxes])
-        box_iou_matrix = np.zeros((len(feature_vecs), len(active_track_ids)))
-        for i, box in enumerate(boxes):
-            box_iou_matrix[i, :] = get_iou2(box, track_boxes)
-        box_iou_matrix = (1 - box_iou_matrix) * 0.5
+        track_boxes = self.tracks.box[active_track_ids]
+        box_iou_matrix = (1 - get_iou_matrix(boxes, track_boxes)) * 0.5
         cost_matrix = cost_matrix + box_iou_matrix
 
-        # Solve Assignment problem
-        track_ids = np.array(self.m.compute(cost_matrix.tolist()))[:, 1]
-        confidences = [
-            similarities[det_id][track_id] for det_id, track_id in enumerate(track_ids)
-        ]
+        # Solve Assignment problem (the cost matrix can be rectangular)
+        det_ids, track_idx = self.assign(cost_matrix)
+        confidences = np.zeros(len(boxes))
+        confidences[det_ids] = similarities[det_ids, track_idx]
 
         # Re-index track_ids with active_track_ids
-        if active_track_ids:
-            track_ids = [active_track_ids[i] for i in track_ids]
+        track_ids = np.array(active_track_ids)[track_idx]
+
+        # Detections which have no track to be assigned (more detections than tracks)
+        unassigned_det_ids = np.setdiff1d(np.arange(len(boxes)), det_ids)
+
+        # Occlusion flags of all detections from the detection x detection IoU
+        overlapped = self.get_overlapped(boxes)
+
+        # Statistics of the euclidean distances of all matched tracks
+        box_ws = boxes[det_ids, 2] - boxes[det_ids, 0]
+        euc_dist_stats = self.get_euc_distance_stats(track_ids, box_ws)
 
         update_detection_dict, not_found_detection_dict = {}, {}
 
         # ------- ReIdentification Loop  ------------ #
-        for det_id, track_id in enumerate(track_ids):
+        for i, (det_id, track_id) in enumerate(zip(det_ids.tolist(), track_ids.tolist())):
 
             # get "detected" person's information
             detection = self.get_person_info(
                 det_id, track_id, confidences, boxes, feature_vecs
             )
-            # track a copy(snapshot) of  tracked person's information
-            tracks = self.tracks.copy()
-            track = tracks[track_id]
+            (
+                detection.euc_dist_mean,
+                detection.euc_dist_std,
+                detection.euc_dist_min,
+                detection.euc_dist_max,
+            ) = euc_dist_stats[i].tolist()
+            track = self.tracks[track_id]
 
             # solve occlustion problem
             # skip update process if detected box and reidentificated box are overlapped.
-            boxes_ = boxes.copy()
-            frame, result = self.solve_occlusion_problem(
-                frame, det_id, detection, boxes_
-            )
+            result = self.solve_occlusion_problem(det_id, detection, overlapped[det_id])
 
             if result:
-                message = f"{frame_id} occlusion det_id:{det_id} person_id:{track.person_id}(track_id:{track_id})"
-                logger.info(message)
+                if self.events.enabled("occlusion"):
+                    self.events.emit(
+                        "occlusion",
+                        frame_id=self.frame_id,
+                        det_id=det_id,
+                        person_id=track.person_id,
+                        track_id=track_id,
+                    )
                 continue
 
             # Evaluate ID assignment
@@ -807,9 +881,14 @@ class Tracker:
                 not_found_detection_dict[det_id] = detection
 
         # Update
+        # Filter the centers of all matched tracks at once with kalman filter
+        track_ids = [detection.track_id for detection in update_detection_dict.values()]
+        centers = [detection.center for detection in update_detection_dict.values()]
+        centers = self.kalman_filter(track_ids, centers)
+
         person_info = []
-        for det_id, detection in update_detection_dict.items():
-            frame, person_dict = self.update(frame, detection)
+        for (det_id, detection), center in zip(update_detection_dict.items(), centers):
+            person_dict = self.update(detection, center)
             person_info.append(person_dict)
             self.show_log(det_id, detection)
 
@@ -818,32 +897,49 @@ class Tracker:
             self.not_found(det_id, detection)
             self.show_log(det_id, detection)
 
+        # Unassigned detections (new persons)
+        self.add_tracks(unassigned_det_ids, boxes, feature_vecs)
+
         # Lost tracks
-        lost_track_ids = [
-            t.track_id for t in tracks if t.stats != DELETED and not t.is_matched
-        ]
+        # active tracks of this frame (excluding new tracks) which were not matched
+        active_track_ids = np.array(active_track_ids)
+        lost_track_ids = active_track_ids[
+            (self.tracks.status[active_track_ids] != DELETED)
+            & ~self.tracks.is_matched[active_track_ids]
+        ].tolist()
         for track_id in lost_track_ids:
             track = self.tracks[track_id]
-            frame = self.lost(frame, track)
+            self.lost(track)
 
         # ----------- post process -------------------- #
-        # After the loops, draw the other information into the frame
-        frame = self.draw_counter_stats(frame)
-        frame = self.draw_params(frame)
-
-        # preserv feature vectors which is used in the register_person function
-        self.prev_feature_vecs = feature_vecs
-        self.prev_track_boxes = boxes
+        # Count the persons who crossed the counting lines
+        self.count_tracks()
 
-        return frame, person_info
+        return person_info, self.get_track_info()
 
     def show_log(self, det_id, detection):
-        frame_id = f"frame_id:{self.frame_id}"
+        # "update" or "not_found" event of the detection
+        event = detection.update
+        if not self.events.enabled(event):
+            return
         track = self.tracks[detection.track_id]
-        header = f"{detection.update} det_id:{det_id} to person_id:{track.person_id}(track_id:{detection.track_id}) sim:{detection.confidence:.3f}"
-        info1 = f"euc_dist:{detection.is_valid_dist}({detection.euc_dist:.3f}) {detection.euc_dist_min:.3f} < {detection.euc_dist:.3f} < {detection.euc_dist_max:.3f}({detection.box_w}) euc_dist_mean:{detection.euc_dist_mean:.3f} euc_dist_std:{detection.euc_dist_std:.3f}"
-        # info2 = f"mah_dist:{detection.is_valid_mah_dist}({detection.mah_dist:.3f})"
-        info3 = f"bbox center:{detection.center} box_iou:{detection.box_iou:.3f}"
-        info4 = f"track:{self.tracks[detection.track_id].__dict__}"
-        # logger.info(f"{frame_id} {header} {info1} {info2} {info3} {info4}")
-        logger.info(f"{frame_id} {header} {info1} {info3} {info4}")
+        self.events.emit(
+            event,
+            frame_id=self.frame_id,
+            det_id=det_id,
+            person_id=track.person_id,
+            track_id=detection.track_id,
+            sim=detection.confidence,
+            euc_dist_valid=detection.is_valid_dist,
+            euc_dist=detection.euc_dist,
+            euc_dist_min=detection.euc_dist_min,
+            euc_dist_max=detection.euc_dist_max,
+            euc_dist_mean=detection.euc_dist_mean,
+            euc_dist_std=detection.euc_dist_std,
+            box_w=detection.box_w,
+            center=detection.center,
+            box_iou=detection.box_iou,
+            hits=track.hits,
+            miss=track.miss,
+            stats=track.stats,
+        )
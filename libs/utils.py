@@ -19,7 +19,42 @@ def resize_frame(frame, height):
     return frame
 
 
+def get_person_boxes(persons, frame_shape):
+    """
+    Scale and clip the person boxes of all detections at once
+
+    :param: persons: detections with the [N, 7] shape
+    :param: frame_shape: shape of the frame which the persons were detected in
+    :returns:
+            boxes: (xmin, ymin, xmax, ymax) with the [N, 4] int shape
+            valid: mask of the boxes with non-zero width and height
+            confidences: confidences with the [N] shape
+    """
+    frame_h, frame_w = frame_shape[:2]
+    frame_size = np.array([frame_w, frame_h, frame_w, frame_h])
+    boxes = (persons[:, 3:7] * frame_size).astype(int)
+    np.clip(boxes, 0, frame_size, out=boxes)
+    # Resizing person_frame will be failed when witdh or height of the person_fame is 0
+    # ex. (243, 0, 3)
+    valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    confidences = persons[:, 2]
+    return boxes, valid, confidences
+
+
+def get_person_frames(persons, frame):
+    # Crop valid person boxes. person frames are views of the frame.
+    boxes, valid, confidences = get_person_boxes(persons, frame.shape)
+    boxes, confidences = boxes[valid], confidences[valid]
+    person_frames = [
+        frame[ymin:ymax, xmin:xmax] for xmin, ymin, xmax, ymax in boxes.tolist()
+    ]
+    return person_frames, boxes, confidences
+
+
 def cos_similarity(X, Y):
+    # Cosine similarity of raw feature vectors. The tracker compares the normalized
+    # vectors with a single matmul instead, and this is kept as the baseline of
+    # benchmark.py.
     m = X.shape[0]
     Y = Y.T  # (m, 256) x (256, n) = (m, n)
     return np.dot(X, Y) / (
@@ -27,6 +62,15 @@ def cos_similarity(X, Y):
     )
 
 
+def l2_normalize(X, eps=1e-12):
+    # input X: (m, 256) feature vectors
+    # output : (m, 256) float32 unit vectors. Rows with zero norm stay zero,
+    #          so that their cosine similarity with any vector is 0.
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    return X / np.maximum(norms, eps)
+
+
 def get_euclidean_distance(x, Y):
     # input x: (1, 2)  center coordinate of a person frame
     #      Y: (m, 2)  center coordinate of the other person frames
@@ -34,21 +78,25 @@ def get_euclidean_distance(x, Y):
     return np.linalg.norm(x - Y, axis=1)
 
 
-def get_iou2(box, boxes):
-    # Input   box  : ndarray (1, 4)
-    #         boxes: ndarray (m, 4)
-    # Output: Iou  : ndarray (m,)
-    ximin = np.maximum(box[0], boxes[:, 0])
-    yimin = np.maximum(box[1], boxes[:, 1])
-    ximax = np.minimum(box[2], boxes[:, 2])
-    yimax = np.minimum(box[3], boxes[:, 3])
-    inter_width = ximax - ximin
-    inter_height = yimax - yimin
+def get_iou_matrix(boxes1, boxes2):
+    # Input   boxes1: ndarray (n, 4)
+    #         boxes2: ndarray (m, 4)
+    # Output: Iou   : ndarray (n, m) of all pairs.
+    #         IoU is 0 when the union area is 0 or unknown (nan box).
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    b1 = boxes1[:, None, :]
+    b2 = boxes2[None, :, :]
+    inter_width = np.minimum(b1[..., 2], b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0])
+    inter_height = np.minimum(b1[..., 3], b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1])
     inter_area = np.maximum(inter_width, 0) * np.maximum(inter_height, 0)
-    box_ = (box[2] - box[0]) * (box[3] - box[1])
-    boxes_ = (boxes[:, 2] - boxes[:, 0]) * (boxes[0:, 3] - boxes[0:, 1])
-    union_area = box_ + boxes_ - inter_area
-    return inter_area / union_area
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union_area = area1[:, None] + area2[None, :] - inter_area
+    iou = np.zeros_like(union_area)
+    with np.errstate(invalid="ignore"):
+        np.divide(inter_area, union_area, out=iou, where=union_area > 0)
+    return iou
 
 
 def get_iou(box1: tuple, box2: tuple) -> float:
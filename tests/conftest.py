@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# libs and the scripts read config.ini and pallete from the current directory
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
@@ -0,0 +1,59 @@
+"""Make the record replayed by tests/test_replay.py
+
+Synthetic detections of persons walking straight across the frame. Each person
+has its own feature vector (with noise per frame) and is missed at random frames.
+
+ex. python tests/data/make_replay_fixture.py tests/data/walkers.rec
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+from libs.recorder import DetectionRecorder  # noqa: E402
+
+FRAME_H, FRAME_W = 576, 1024
+N_PERSONS, N_FRAMES = 8, 120
+FEATURE_DIM = 32
+
+
+def make_fixture(path, seed=0):
+    rng = np.random.default_rng(seed)
+    start = rng.integers(1, N_FRAMES // 2, N_PERSONS)
+    centers = np.stack(
+        [
+            rng.uniform(150, FRAME_W - 150, N_PERSONS),
+            rng.uniform(120, FRAME_H - 120, N_PERSONS),
+        ],
+        axis=1,
+    )
+    velocities = rng.uniform(-6, 6, (N_PERSONS, 2))
+    sizes = np.stack(
+        [rng.uniform(35, 60, N_PERSONS), rng.uniform(90, 140, N_PERSONS)], axis=1
+    )
+    embeddings = rng.standard_normal((N_PERSONS, FEATURE_DIM))
+
+    with DetectionRecorder(path, (FRAME_H, FRAME_W, 3), FEATURE_DIM) as recorder:
+        for frame_id in range(1, N_FRAMES + 1):
+            boxes, feature_vecs = [], []
+            for i in range(N_PERSONS):
+                if frame_id < start[i] or rng.random() < 0.05:
+                    continue
+                center = centers[i] + velocities[i] * (frame_id - start[i])
+                if not (0 < center[0] < FRAME_W and 0 < center[1] < FRAME_H):
+                    continue
+                box = np.r_[center - sizes[i] / 2, center + sizes[i] / 2]
+                box += rng.normal(0, 1.5, 4)
+                boxes.append(np.clip(box, 0, [FRAME_W, FRAME_H, FRAME_W, FRAME_H]))
+                feature_vecs.append(embeddings[i] + rng.normal(0, 0.35, FEATURE_DIM))
+            recorder.write(
+                frame_id,
+                np.array(boxes).reshape(-1, 4),
+                np.full(len(boxes), 0.9),
+                np.array(feature_vecs).reshape(-1, FEATURE_DIM),
+            )
+
+
+if __name__ == "__main__":
+    make_fixture(sys.argv[1])
@@ -0,0 +1,46 @@
+"""Count the crossings of a counting line by a tracked person"""
+import numpy as np
+import pytest
+
+import libs.tracker
+from libs.tracker import Tracker
+
+DOOR = {"door": [(100, 300), (900, 300)]}
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(libs.tracker, "counting_lines", DOOR)
+    return Tracker(None, np.zeros((576, 1024, 3), dtype=np.uint8), 0)
+
+
+def track(tracker, centers):
+    # Feed the detections of one person whose box centers are given
+    feature_vec = np.random.default_rng(0).standard_normal((1, 32))
+    for frame_id, (cx, cy) in enumerate(centers, 1):
+        tracker.frame_id = frame_id
+        boxes = np.array([[cx - 30, cy - 60, cx + 30, cy + 60]])
+        tracker.person_reidentification(None, boxes, feature_vec)
+    return tracker.line_counter.get_counts()["door"]
+
+
+def test_jitter_on_line_is_counted_once_at_most(tracker):
+    # stands on the line and the detected center jitters across it every frame
+    centers = [(500, 300 + (20 if i % 2 else -20)) for i in range(300)]
+    counts = track(tracker, centers)
+    assert counts["in"] + counts["out"] <= 1
+
+
+def test_walk_through_and_back_is_counted_per_direction(tracker):
+    down = [(500, y) for y in range(200, 400, 5)]
+    up = [(500, y) for y in range(400, 200, -5)]
+    counts = track(tracker, down + [(500, 400)] * 20 + up)
+    assert counts == {"in": 1, "out": 1}
+
+
+def test_jitter_is_counted_without_settle_frames(tracker, monkeypatch):
+    # check that the jitter of the test above crosses the line
+    monkeypatch.setattr(libs.tracker, "count_settle_frames", 0)
+    centers = [(500, 300 + (20 if i % 2 else -20)) for i in range(300)]
+    counts = track(tracker, centers)
+    assert counts["in"] + counts["out"] > 10
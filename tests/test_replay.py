@@ -0,0 +1,55 @@
+"""Replay the recorded detections headlessly and check the summary
+
+tests/data/walkers.rec is made by tests/data/make_replay_fixture.py. The expected
+counts change when the tracker or the [TRACKER] section of config.ini changes.
+"""
+import json
+import os
+
+import pytest
+
+import headless
+from libs.argparser import build_headless_argparser
+
+RECORD = os.path.join(os.path.dirname(__file__), "data", "walkers.rec")
+
+
+def replay(tmp_path, *args):
+    args = build_headless_argparser().parse_args(
+        ["-i", RECORD, "--replay", "-o", str(tmp_path), *args]
+    )
+    assert headless.replay(args) == 0
+    with open(tmp_path / "walkers_summary.json") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize(
+    "grid, counter_stats",
+    [
+        (
+            "0",
+            {
+                "top": {"in": 0, "out": 0},
+                "right": {"in": 0, "out": 0},
+                "bottom": {"in": 0, "out": 0},
+                "left": {"in": 0, "out": 0},
+            },
+        ),
+        (
+            "6",
+            {
+                "top": {"in": 0, "out": 2},
+                "right": {"in": 0, "out": 3},
+                "bottom": {"in": 0, "out": 2},
+                "left": {"in": 0, "out": 0},
+            },
+        ),
+    ],
+)
+def test_replay_summary(tmp_path, grid, counter_stats):
+    summary = replay(tmp_path, "-g", grid)
+    assert summary["frames"] == 120
+    assert summary["persons"] == 8
+    assert summary["tracks"] == 8
+    assert summary["counter_stats"] == counter_stats
+    assert (tmp_path / "walkers_tracks.csv").exists()